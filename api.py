@@ -1,4 +1,3 @@
-import json
 import os
 import threading
 import time
@@ -8,9 +7,9 @@ import subprocess
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest
 from common.utils import create_simulation_schema
-from package.logger_manager import LoggerManager
+from package.logger_manager import LoggerManager, load_simulation
+from package.simulation_index import SimulationIndex
 from dotenv import load_dotenv
-from common.config import SIMULATION_OUTPUT_PATH
 
 load_dotenv('.env.development')
 app = Flask(__name__)
@@ -24,6 +23,9 @@ CORS(app)
 
 # Dictionary to track running simulation processes
 simulation_processes = {}
+SERVER_LISTENING = "Unicast server listening"  # Printed by the server once the receivers can connect
+SERVER_START_TIMEOUT = 30  # Seconds to wait for it before starting the receivers anyway
+simulation_index = SimulationIndex()
 
 def is_valid_command(commands):
     """Ensure the commands are valid before running them."""
@@ -57,12 +59,14 @@ def is_valid_command(commands):
     
     return False
 
-def read_stream(stream, stream_name, sim_id, on_error=False):
-    """Helper function to read the stream and print it in real-time."""
+def read_stream(stream, stream_name, sim_id, on_error=False, listening=None):
+    """Helper function to read the stream and print it in real-time, setting the listening event when the server listens."""
     logger = LoggerManager(sim_id)
     while True:
         output = stream.readline()
         if output:
+            if listening is not None and SERVER_LISTENING in output:
+                listening.set()
             print(str(f"{output.strip()}"))
             logger.update("logs", str(f"{output.strip()}"), append=True)
             if str(output.strip()).startswith("ERROR") or str(output.strip()).startswith("CRITICAL") or on_error: 
@@ -70,22 +74,23 @@ def read_stream(stream, stream_name, sim_id, on_error=False):
             elif str(output.strip()).startswith("FINISHED"):
                 logger.update("status", "complete")
 
-        if output == '' and stream.closed:
-            break
+        if output == '':
+            break  # End of the stream, the process exited
 
-def start_process(commands, sim_id):
+def start_process(commands, sim_id, listening=None):
     """Start the process and read the output in a non-blocking way."""
-    # Start the process
+    # Start the process, unbuffered so that its lines are read as soon as they are printed
     print(f'Running command: {" ".join(commands)}')
     process = subprocess.Popen(
         commands,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True
+        text=True,
+        env={**os.environ, "PYTHONUNBUFFERED": "1"}
     )
     
     # Create separate threads to read stdout and stderr in real-time
-    stdout_thread = threading.Thread(target=read_stream, args=(process.stdout, "STDOUT", sim_id))
+    stdout_thread = threading.Thread(target=read_stream, args=(process.stdout, "STDOUT", sim_id, False, listening))
     stderr_thread = threading.Thread(target=read_stream, args=(process.stderr, "STDERR", sim_id, True))  # Set on_error to True for stderr
 
     # Start the threads
@@ -100,12 +105,24 @@ def start_process(commands, sim_id):
     stderr_thread.join()
 
     print(f"Process finished with exit code {process.returncode}")
+    if listening is not None:
+        listening.set()  # Never waits for a process that is gone
     
-def start_process_in_background(commands, sim_id):
+def start_process_in_background(commands, sim_id, listening=None):
     """Start the process in the background."""
-    thread = threading.Thread(target=start_process, args=(commands, sim_id))
+    thread = threading.Thread(target=start_process, args=(commands, sim_id, listening))
     thread.start()
     
+def start_simulation(sim_id, commands_server, commands_clients):
+    """Start the server, then the receivers as soon as the server listens: the server starts the session
+    once they all got their cache and joined the multicast groups."""
+    server_listening = threading.Event()
+    start_process_in_background(commands_server, sim_id, server_listening)
+    if not server_listening.wait(SERVER_START_TIMEOUT):
+        print(f"Server not listening after {SERVER_START_TIMEOUT} s, starting the receivers anyway")
+    for commands_client in commands_clients:
+        start_process_in_background(commands_client, sim_id)
+
 @app.route('/create_simulation', methods=['POST'])
 def create_simulation():
     """Create a simulation and start the process without streaming events."""
@@ -120,44 +137,42 @@ def create_simulation():
 
     # Simulate creating a unique simulation ID
     simulation_id = create_simulation_schema(nb_receivers, nb_routers)
+    LoggerManager(simulation_id).update_index({"status": "pending", "created": time.time(), "nb_receivers": nb_receivers})
 
     # Commands to start server and client
     commands_server = ["python3", "server.py", "2", "-c", "server.ini", "-sim_id", simulation_id]
     commands_client = ["python3", "receiver.py", "1", "-rq", "2", "-c", "receiver.ini", "-sim_id", simulation_id]
     commands_client2 = ["python3", "receiver.py", "2", "-rq", "5", "-c", "receiver.ini", "-sim_id", simulation_id]
 
-    # Start the server and client processes in the background
-    start_process_in_background(commands_server, simulation_id)
-    time.sleep(2)
-    start_process_in_background(commands_client, simulation_id)
-    time.sleep(1)
-    start_process_in_background(commands_client2, simulation_id)
-
+    # Start the server and client processes in the background, the request returns at once: clients poll the simulation
+    thread = threading.Thread(target=start_simulation, args=(simulation_id, commands_server, [commands_client, commands_client2]))
+    thread.start()
 
     return jsonify({"simulation_id": simulation_id}), 201
 
 @app.route('/simulations/<simulation_id>')
 def get_simulation(simulation_id):
     try:
-        simulation_path = os.path.join(SIMULATION_OUTPUT_PATH, f'{simulation_id}.json')
-        with open(simulation_path, 'r') as file:
-            simulation = json.load(file)
+        # The base document with the updates of the log applied, see LoggerManager
+        simulation = load_simulation(simulation_id)
         return jsonify(simulation), 200
     except FileNotFoundError:
         return jsonify({'error': 404}), 404
 
 @app.route('/simulations')
 def get_simulations():
+    """List the simulations, newest first, from the index: ?status= to filter, ?page= and ?per_page= to paginate.
+    The number of simulations with the status is given in the X-Total-Count header."""
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args['per_page']) if 'per_page' in request.args else None
+        if page < 1 or (per_page is not None and per_page < 1):
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "Invalid pagination"}), 400
     try:
-        simulations = []
-        
-        for filename in os.listdir(SIMULATION_OUTPUT_PATH):
-            if filename.endswith(".json"):
-                with open(os.path.join(SIMULATION_OUTPUT_PATH, filename), 'r') as file:
-                    simulation_data = json.load(file)
-                    simulations.append({"id":simulation_data["id"], "status":simulation_data["status"] })
-        
-        return jsonify(simulations), 200
+        simulations, total = simulation_index.list(request.args.get('status'), page, per_page)
+        return jsonify(simulations), 200, {"X-Total-Count": str(total)}
     except FileNotFoundError:
         return jsonify([]), 404
     
@@ -0,0 +1,89 @@
+'''
+End-to-end check of a session on the local machine, wired as in server.py: the unicast server gets the caches of the
+multicast server before start() is called, then receivers get their cache, join the multicast group, receive and decode
+their file. Fails (exit status 1) unless every receiver saves a copy identical to the video it requested.
+
+Run from the repository root:
+
+    python3 -m benchmarks.session_check -p 22300
+'''
+import argparse
+import json
+import os
+import threading
+import time
+from package.multicast_server import MulticastServer
+from package.unicast_server import UnicastServer
+from package.receiver import MulticastReceiver
+from package.cache import Cache
+from common.utils import read_config
+from common.config import VIDEO_PATH
+
+SESSION_TIMEOUT = 60  # Seconds for the whole session, a session that does not end fails
+RECEIVERS = ['paul', 'anto', 'jony', 'elio', 'rony']
+REQUESTED_FILES = {1: 2, 2: 5, 3: 6, 4: 8, 5: 9}
+CACHE_CAPACITY = 4
+
+
+def run_receiver(receiver, file_id, cache_file):
+    cache = Cache(cache_file)
+    receiver.send_unicast_request(file_id, cache)
+    receiver.set_cache(cache)
+    receiver.start(file_id)
+
+
+def run(port, nb_receivers, wire_format, rate_mbps):
+    sim_id = f"session_check_{int(time.time())}"
+    config = read_config("server.ini")
+    with open(config['LIBRARY_FILE'], 'r') as file:
+        files = json.load(file)['files']
+    multicast_server = MulticastServer(sim_id, config['MULTICAST_GROUPS'][0], files, RECEIVERS, CACHE_CAPACITY, REQUESTED_FILES, nb_receivers,
+                                       wire_format=wire_format, rate_mbps=rate_mbps)
+    unicast_server = UnicastServer(sim_id, users_cache=multicast_server.get_users_cache(), config_file="server.ini", port=port)
+    unicast_server.multicast_addresses = unicast_server.multicast_addresses[:1]
+    threading.Thread(target=unicast_server.start, daemon=True).start()
+    server_thread = threading.Thread(target=multicast_server.start, args=(unicast_server,), daemon=True)
+    server_thread.start()
+
+    receivers = {}
+    for user in range(1, nb_receivers + 1):
+        receiver = MulticastReceiver(sim_id, user, "receiver.ini")
+        receiver.unicast_server_address = (unicast_server.host, port)
+        receivers[user] = receiver
+    threads = [threading.Thread(target=run_receiver, args=(receiver, REQUESTED_FILES[user], f"{sim_id}-{user}.cache"), daemon=True)
+               for user, receiver in receivers.items()]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + SESSION_TIMEOUT
+    for thread in threads + [server_thread]:
+        thread.join(max(0, deadline - time.monotonic()))
+    ok = not any(thread.is_alive() for thread in threads + [server_thread])
+    if not ok:
+        print(f"Session did not end after {SESSION_TIMEOUT} s")
+    for user, receiver in receivers.items():
+        file = files[REQUESTED_FILES[user] - 1]
+        try:
+            with open(receiver.get_output_path(REQUESTED_FILES[user]), 'rb') as output, open(os.path.join(VIDEO_PATH, file["compressed_path"]), 'rb') as video:
+                identical = output.read() == video.read()
+        except OSError:
+            identical = False
+        print(f"Receiver {user}: file {REQUESTED_FILES[user]} {'identical' if identical else 'NOT identical'}")
+        ok = ok and identical
+    print(f"Session phases: {multicast_server.state.get_durations()}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Session check',
+                    description='Runs a local session end to end and checks the files decoded by the receivers.',
+                    )
+    parser.add_argument('-p', '--port', help='The port of the unicast server.', type=int, default=22300)
+    parser.add_argument('-n', '--nb_receivers', help='The number of receivers.', type=int, default=2)
+    parser.add_argument('-f', '--wire_format', help='The format of the multicast datagrams: binary or json_debug.', type=str, default="binary")
+    parser.add_argument('-r', '--rate_mbps', help='The send rate in Mbit/s (0 = unlimited).', type=float, default=200)
+
+    args = parser.parse_args()
+    ok = run(args.port, args.nb_receivers, args.wire_format, args.rate_mbps)
+    # The unicast server thread serves forever
+    os._exit(0 if ok else 1)
@@ -0,0 +1,36 @@
+'''
+Trade-off between the delivery rate and the subpacketization of the coded caching scheme, for every group size K'.
+When t=K'*M/N is not an integer, the files are shared between the two neighbouring integer values of t (memory sharing).
+The delivery rate is in number of files, for K users all requesting a file, next to the lower convex envelope of the
+rates of the integer values of t.
+
+Run from the repository root:
+
+    python3 -m benchmarks.subpacketization_report -K 50 -N 100 -M 20
+'''
+import argparse
+from package.multicast_session import MulticastSession
+
+
+def run(nb_receivers, nb_files, cache_capacity):
+    print(f"K={nb_receivers}, N={nb_files}, M={cache_capacity}")
+    print(f"{'group size':>10} | {'groups':>6} | {'t':>6} | {'subfiles per file':>20} | {'delivery rate':>13} | {'envelope':>8}")
+    for group_size in range(1, nb_receivers + 1):
+        session = MulticastSession(library=[None] * nb_files, receivers=list(range(nb_receivers)), cache_capacity=cache_capacity, group_size=group_size)
+        if not session.check_parameters():
+            raise ValueError(f"M={cache_capacity} is not between 0 and N={nb_files}")
+        print(f"{group_size:>10} | {session.get_nb_groups():>6} | {session.t:>6.4g} | {session.get_subpacketization():>20} | "
+              f"{session.get_delivery_rate():>13.3f} | {session.get_rate_envelope():>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Subpacketization report',
+                    description='Compares the delivery rate and the number of subfiles per file of the grouped coded caching schemes.',
+                    )
+    parser.add_argument('-K', '--nb_receivers', help='The number of users.', type=int, default=50)
+    parser.add_argument('-N', '--nb_files', help='The number of files of the library.', type=int, default=100)
+    parser.add_argument('-M', '--cache_capacity', help='The cache capacity, in number of files.', type=float, default=20)
+
+    args = parser.parse_args()
+    run(args.nb_receivers, args.nb_files, args.cache_capacity)
@@ -0,0 +1,47 @@
+'''
+Micro-benchmark of the XOR engine against the legacy generator based lambda.
+
+Run from the repository root:
+
+    python3 -m benchmarks.xor_benchmark
+'''
+import argparse
+import os
+import timeit
+from common.xor_engine import HAS_NUMPY, xor_bytes, xor_into
+
+legacy_xor = lambda x, y: bytes(i ^ j for i, j in zip(x, y))
+
+
+def legacy_xor_many(operands):
+    packet = operands[0]
+    for op in operands[1:]:
+        packet = legacy_xor(packet, op)
+    return packet
+
+
+def run(sizes, nb_operands, repeat):
+    print(f"backend: {'numpy' if HAS_NUMPY else 'big-int'}, operands: {nb_operands}")
+    print(f"{'size':>12} | {'legacy (s)':>12} | {'xor_bytes (s)':>14} | {'xor_into (s)':>13} | {'speedup':>8}")
+    for size in sizes:
+        operands = [os.urandom(size) for _ in range(nb_operands)]
+        out = bytearray(size)
+        assert legacy_xor_many(operands) == xor_bytes(*operands)
+
+        legacy = min(timeit.repeat(lambda: legacy_xor_many(operands), number=1, repeat=repeat))
+        engine = min(timeit.repeat(lambda: xor_bytes(*operands), number=1, repeat=repeat))
+        in_place = min(timeit.repeat(lambda: xor_into(out, operands), number=1, repeat=repeat))
+        print(f"{size:>12} | {legacy:>12.6f} | {engine:>14.6f} | {in_place:>13.6f} | {legacy / in_place:>7.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='XOR benchmark',
+                    description='Compares the XOR engine with the legacy per-byte XOR.',
+                    )
+    parser.add_argument('-s', '--sizes', help='The operand sizes in bytes.', nargs='+', type=int, default=[1024, 157254, 1572544])
+    parser.add_argument('-n', '--nb_operands', help='The number of XORed operands (t+1).', type=int, default=3)
+    parser.add_argument('-r', '--repeat', help='The number of repetitions per measure.', type=int, default=3)
+
+    args = parser.parse_args()
+    run(args.sizes, args.nb_operands, args.repeat)
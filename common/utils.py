@@ -6,6 +6,7 @@ import time
 from loguru import logger # type: ignore
 import gzip
 import io
+from collections.abc import Mapping
 from common.config import SIMULATION_OUTPUT_PATH, DATA_PATH
 
 
@@ -17,7 +18,6 @@ def custom_logger(message, level="INFO"):
     print(f"{level.upper()}:{message}")
 
 logger.remove()
-xor = lambda x, y: bytes(i ^ j for i, j in zip(x, y))
 
 
 def compress_chunk(chunk):
@@ -36,13 +36,13 @@ def split_into_chunks(data, chunk_size, last_packet=b"LAST_PACKET"):
 def encode_packet(packet):
         # Custom encoding function to handle bytes
         def encode_bytes(obj):
-            if isinstance(obj, bytes):
+            if isinstance(obj, (bytes, bytearray, memoryview)):
                 return base64.b64encode(obj).decode('utf-8')
             if isinstance(obj, tuple):
                 return tuple(encode_bytes(item) for item in obj)
             if isinstance(obj, list):
                 return [encode_bytes(item) for item in obj]
-            if isinstance(obj, dict):
+            if isinstance(obj, Mapping):
                 return {str(key): encode_bytes(value) for key, value in obj.items()}
             return obj
         
@@ -140,7 +140,21 @@ def read_config(config_file):
             groups.append(multicast_group)
             i = i +1
         library_file = config.get('server', 'library_file')
-        return {'MULTICAST_GROUPS': groups, 'LIBRARY_FILE': library_file}
+        encoding_workers = config.getint('server', 'encoding_workers', fallback=1)
+        wire_format = config.get('server', 'wire_format', fallback='binary')
+        fec_ratio = config.getfloat('server', 'fec_ratio', fallback=0)
+        fec_block_size = config.getint('server', 'fec_block_size', fallback=32)
+        send_rate_mbps = config.getfloat('server', 'send_rate_mbps', fallback=0)
+        send_rate_pps = config.getfloat('server', 'send_rate_pps', fallback=0)
+        mtu = config.getint('server', 'mtu', fallback=1500)
+        socket_sndbuf = config.getint('server', 'socket_sndbuf', fallback=0)
+        user_group_size = config.getint('server', 'user_group_size', fallback=0)
+        group_mode = config.get('server', 'group_mode', fallback='stripe')
+        placement_file = config.get('server', 'placement_file', fallback='')
+        return {'MULTICAST_GROUPS': groups, 'LIBRARY_FILE': library_file, 'ENCODING_WORKERS': encoding_workers, 'WIRE_FORMAT': wire_format,
+                'FEC_RATIO': fec_ratio, 'FEC_BLOCK_SIZE': fec_block_size, 'SEND_RATE_MBPS': send_rate_mbps, 'SEND_RATE_PPS': send_rate_pps,
+                'MTU': mtu, 'SOCKET_SNDBUF': socket_sndbuf, 'USER_GROUP_SIZE': user_group_size, 'GROUP_MODE': group_mode,
+                'PLACEMENT_FILE': placement_file}
     except Exception as e:
         logger.error(f"Error reading config file {config_file}: {e}")
         raise
@@ -181,6 +195,43 @@ def get_unicast_address(config_file):
         logger.error(f"Error reading config file {config_file}: {e}")
         raise
     
+def read_unicast_config(config_file):
+    """
+    Reads the configuration file and returns the settings of the unicast (placement) server.
+
+    :param config_file: Path to the configuration file
+    :return: Configuration dictionary
+    """
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_file)
+        unicast_ip = str(config.get('unicast_server', 'unicast_ip'))
+        multicast_addresses = json.loads(config.get('server', 'multicast_groups'))
+        backlog = config.getint('unicast_server', 'backlog', fallback=1024)
+        max_clients = config.getint('unicast_server', 'max_clients', fallback=64)
+        send_buffer_size = config.getint('unicast_server', 'send_buffer_size', fallback=262144)
+        return {'UNICAST_IP': unicast_ip, 'MULTICAST_ADDRESSES': multicast_addresses, 'BACKLOG': backlog,
+                'MAX_CLIENTS': max_clients, 'SEND_BUFFER_SIZE': send_buffer_size}
+    except Exception as e:
+        logger.error(f"Error reading config file {config_file}: {e}")
+        raise
+
+def get_socket_rcvbuf(config_file, default=0):
+    """
+    Reads the configuration file and returns the receive buffer size of the multicast sockets.
+
+    :param config_file: Path to the configuration file
+    :param default: Size returned when the file does not set it (0 = system default)
+    :return: the buffer size in bytes as int
+    """
+    try:
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        return config.getint('receiver', 'socket_rcvbuf', fallback=default)
+    except Exception as e:
+        logger.error(f"Error reading config file {config_file}: {e}")
+        raise
+    
 def create_simulation_schema(nb_receivers, nb_routers):
     simulation_id = f"sim_{int(time.time())}"
     file_path = os.path.join(SIMULATION_OUTPUT_PATH, f'{simulation_id}.json')
@@ -354,9 +405,10 @@ def create_simulation_schema(nb_receivers, nb_routers):
             ],
             "target": ".demo_origin_server"
         })
-    # Write the updated data to a JSON file
-    with open(file_path, 'w') as json_file:
+    # Write the updated data to a JSON file, moved in place once complete so that it is never read half-written
+    with open(f"{file_path}.tmp", 'w') as json_file:
         json.dump(data, json_file, indent=4)
+    os.replace(f"{file_path}.tmp", file_path)
     
     return simulation_id
 
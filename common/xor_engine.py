@@ -0,0 +1,62 @@
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the big-int backend is used instead
+    np = None
+
+HAS_NUMPY = np is not None
+
+
+def _as_uint8(buffer, count=None):
+    return np.frombuffer(buffer, dtype=np.uint8, count=-1 if count is None else count)
+
+
+def xor_into(out, operands):
+    '''
+    XORs all the operands together into a preallocated output buffer, in place.
+
+    Unequal-length operands are handled as if they were zero-padded on the right:
+    an operand shorter than the output only affects its first len(operand) bytes,
+    an operand longer than the output is truncated to len(out).
+
+    :param out:         (bytearray or writable memoryview) the output buffer, its length defines the result length
+    :param operands:    (iterable) bytes-like objects (bytes, bytearray, memoryview, mmap slices, ...)
+
+    :return:    the output buffer
+    '''
+    length = len(out)
+    operands = [op for op in operands if op is not None]
+
+    if np is not None:
+        acc = _as_uint8(out)
+        acc[:] = 0
+        for op in operands:
+            n = min(len(op), length)
+            if n:
+                np.bitwise_xor(acc[:n], _as_uint8(op, n), out=acc[:n])
+        return out
+
+    acc = 0
+    for op in operands:
+        n = min(len(op), length)
+        if n:
+            # Little endian: shorter operands are implicitly zero-padded on the right
+            acc ^= int.from_bytes(op[:n], 'little')
+    out[:] = acc.to_bytes(length, 'little')
+    return out
+
+
+def xor_bytes(*operands, length=None):
+    '''
+    XORs whole buffers at once and returns the result as bytes.
+
+    :param operands:    bytes-like objects to XOR together
+    :param length:      (int) the length of the result; defaults to the length of the longest operand
+                        (shorter operands are zero-padded, see xor_into)
+
+    :return:    (bytes) the XOR of all the operands
+    '''
+    if length is None:
+        length = max((len(op) for op in operands if op is not None), default=0)
+    out = bytearray(length)
+    xor_into(out, operands)
+    return bytes(out)
@@ -1,40 +1,200 @@
+'''
+Receiver cache files.
+
+A cache file is binary (version 1, network byte order):
+
+    header          magic "LCCACHE" (7s), version (B), number of subfiles (I)
+    index           per subfile: file ID (H), length t of the subfile index (B), subfile index (t * H),
+                    offset of the payload in the file (Q), length of the payload (I)
+    payloads        the raw subfiles
+
+The file is memory-mapped and the subfiles are exposed as memoryview slices of the mapping, nothing is copied.
+Caches written by the previous versions, as the str() of the content dictionary, are still read and converted on first use:
+in place, or from the former .txt file of the cache when the binary file does not exist yet.
+'''
 import ast
+import mmap
+import struct
 from collections import defaultdict
 import os
 from common.utils import custom_logger
 from common.config import CACHE_PATH
+
+CACHE_MAGIC = b"LCCACHE"
+LEGACY_SUFFIX = ".txt"  # Name of the text caches of the previous versions, in place of the suffix of the binary file
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("!7sBI")
+ENTRY_HEAD = struct.Struct("!HB")
+ENTRY_LOCATION = struct.Struct("!QI")
+
+
+def build_cache_index(content):
+    '''
+    :param content: (dict) a cache content, file ID --> {subfile index: subfile}
+
+    :return:    (dict) (file ID, subfile index) --> subfile
+    '''
+    return {(file_id, tuple(index)): value for file_id, subfiles in content.items() for index, value in subfiles.items()}
+
+
+class CacheFileWriter:
+    '''
+    Writes a binary cache file whose subfiles are known in advance but arrive one by one, in any order:
+    the header and the index are written first, then each subfile at its offset. The file is written under a temporary
+    name and renamed on commit, so a reader never sees a partial cache.
+    '''
+
+    def __init__(self, path, entries):
+        '''
+        :param path:    (str) the path of the cache file
+        :param entries: (list) tuples (file ID, subfile index, length)
+        '''
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        index = bytearray(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, len(entries)))
+        offset = len(index) + sum(ENTRY_HEAD.size + 2 * len(subfile) + ENTRY_LOCATION.size for _, subfile, _ in entries)
+        self.locations = []
+        for file_id, subfile, length in entries:
+            index += ENTRY_HEAD.pack(int(file_id), len(subfile)) + struct.pack(f"!{len(subfile)}H", *subfile)
+            index += ENTRY_LOCATION.pack(offset, length)
+            self.locations.append((offset, length))
+            offset += length
+
+        self.file = open(self.tmp_path, 'wb')
+        self.file.write(index)
+        self.file.truncate(offset)
+
+    def write(self, position, data):
+        '''
+        :param position:    (int) the position of the subfile in the entries
+        :param data:        (bytes-like) the subfile
+        '''
+        offset, length = self.locations[position]
+        if len(data) != length:
+            raise ValueError(f"Subfile {position} has {len(data)} bytes, {length} expected")
+        self.file.seek(offset)
+        self.file.write(data)
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+def write_cache_file(path, content):
+    '''
+    Writes a cache content in the binary format.
+
+    :param path:    (str) the path of the cache file
+    :param content: (dict) file ID --> {subfile index: subfile (bytes-like)}
+    '''
+    subfiles = list(build_cache_index(content).items())
+    writer = CacheFileWriter(path, [(file_id, subfile, len(value)) for (file_id, subfile), value in subfiles])
+    for position, (_, value) in enumerate(subfiles):
+        writer.write(position, value)
+    writer.commit()
+
+
+def read_cache_index(data):
+    '''
+    :param data:    (bytes-like) the content of a binary cache file
+
+    :return:    (dict) (file ID, subfile index) --> memoryview of the subfile in data
+    '''
+    view = memoryview(data)
+    magic, version, nb_entries = CACHE_HEADER.unpack_from(view)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION:
+        raise ValueError(f"Unsupported cache file (magic {magic}, version {version})")
+    index = {}
+    position = CACHE_HEADER.size
+    for _ in range(nb_entries):
+        file_id, t = ENTRY_HEAD.unpack_from(view, position)
+        position += ENTRY_HEAD.size
+        subfile = struct.unpack_from(f"!{t}H", view, position)
+        position += 2 * t
+        offset, length = ENTRY_LOCATION.unpack_from(view, position)
+        position += ENTRY_LOCATION.size
+        index[(file_id, subfile)] = view[offset:offset + length]
+    return index
+
+
 class Cache:
-    def __init__(self, filename='cache.txt'):
+    def __init__(self, filename='cache.bin'):
         self.filename = os.path.join(CACHE_PATH, filename)
+        self.index = None  # (file ID, subfile index) --> memoryview, loaded on first use
 
     def get_content(self):
+        '''
+        :return:    (defaultdict) file ID --> {subfile index: memoryview}
+        '''
+        content = defaultdict(dict)
+        for (file_id, subfile), value in self.get_index().items():
+            content[file_id][subfile] = value
+        return content
+
+    def get_index(self):
+        '''
+        Maps the cache file once and indexes its subfiles by (file ID, subfile index).
+        '''
+        if self.index is None:
+            self.index = self.load_index()
+        return self.index
+
+    def get_legacy_filename(self):
+        '''
+        :return:    (str) the path of the text cache written by the previous versions in place of this one
+        '''
+        return os.path.splitext(self.filename)[0] + LEGACY_SUFFIX
+
+    def load_index(self):
         try:
-            with open(self.filename, 'r') as file:
-                content = file.read().strip()
-                if content:
-                    dict_data = ast.literal_eval(content)
-                    if isinstance(dict_data, dict):
-                        default_dict_data = defaultdict(dict)
-                        for key1, inner_dict in dict_data.items():
-                            for key2, value in inner_dict.items():
-                                default_dict_data[key1][key2] = value
-                        return default_dict_data
-                    else:
-                        custom_logger(f"Error: {self.filename} does not contain a valid dictionary.", level="error")
-                        return defaultdict(dict)
-                else:
-                    custom_logger(f"Error reading {self.filename}: {e}", level="error")
-                    return defaultdict(dict)
+            if not os.path.exists(self.filename) and os.path.exists(self.get_legacy_filename()):
+                self.migrate(self.get_legacy_filename())
+            with open(self.filename, 'rb') as file:
+                if file.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                    self.migrate(self.filename)
+                    return self.load_index()
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            return read_cache_index(data)
         except FileNotFoundError:
             custom_logger(f"Error: {self.filename} not found.", level="error")
-            return defaultdict(dict)
         except Exception as e:
             custom_logger(f"Error reading {self.filename}: {e}", level="error")
-            return defaultdict(dict)
+        return {}
+
+    def migrate(self, text_filename):
+        '''
+        Converts a cache written in the former text format (the str() of the content) to the binary format, in the cache file.
+
+        :param text_filename:   (str) the path of the text cache, the cache file itself or the former .txt file
+        '''
+        content = self.read_text_content(text_filename)
+        write_cache_file(self.filename, content)
+        custom_logger(f"Converted {text_filename} to the binary cache format in {self.filename}", level="info")
+
+    def read_text_content(self, text_filename):
+        with open(text_filename, 'r') as file:
+            content = file.read().strip()
+        dict_data = ast.literal_eval(content) if content else {}
+        if not isinstance(dict_data, dict):
+            raise ValueError(f"{text_filename} does not contain a valid dictionary.")
+        return dict_data
+
+    def open_writer(self, entries):
+        '''
+        :param entries: (list) tuples (file ID, subfile index, length) of the subfiles to store
+
+        :return:    (CacheFileWriter) the writer of the new content of the cache, read once committed
+        '''
+        self.index = None
+        return CacheFileWriter(self.filename, entries)
 
     def set_content(self, content):
         try:
-            with open(self.filename, 'w') as file:
-                file.write(str(content))
+            write_cache_file(self.filename, content)
+            self.index = None  # The previous mapping, if any, is released with the last view on it
         except Exception as e:
-            print(f"Error writing to {self.filename}: {e}")
+            custom_logger(f"Error writing to {self.filename}: {e}", level="error")
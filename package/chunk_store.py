@@ -0,0 +1,112 @@
+import mmap
+import os
+import threading
+from collections.abc import Mapping
+from common.utils import custom_logger
+from common.config import VIDEO_PATH
+
+
+class FileChunks(Mapping):
+    '''
+    The chunks of a mapped file: chunk index --> memoryview slice of the mapping, cut on access from the chunk boundaries.
+    '''
+
+    def __init__(self, view, subfile_ids, boundaries):
+        '''
+        :param view:        (memoryview) the mapped file
+        :param subfile_ids: (dict) chunk index --> position of the chunk in the session indices
+        :param boundaries:  (list) the offsets delimiting the chunks, as given by MulticastSession.get_subfile_boundaries
+        '''
+        self.view = view
+        self.subfile_ids = subfile_ids
+        self.boundaries = boundaries
+
+    def get_location(self, index):
+        '''
+        :return:    (tuple) the (offset, length) of the chunk in the file
+        '''
+        i = self.subfile_ids[index]
+        return self.boundaries[i], self.boundaries[i + 1] - self.boundaries[i]
+
+    def __getitem__(self, index):
+        i = self.subfile_ids[index]
+        return self.view[self.boundaries[i]:self.boundaries[i + 1]]
+
+    def __contains__(self, index):
+        return index in self.subfile_ids
+
+    def __iter__(self):
+        return iter(self.subfile_ids)
+
+    def __len__(self):
+        return len(self.subfile_ids)
+
+
+class ChunkStore:
+    '''
+    Read-only store of the library chunks (subfiles).
+    Each video is memory-mapped once and its chunks are exposed as memoryview slices of the mapping,
+    keyed by the chunk indices of the MulticastSession, so they can be XORed, cached and sent without copies.
+    '''
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, session, indices, video_path=VIDEO_PATH, boundaries=None):
+        '''
+        :param session:     (MulticastSession) the session defining how the files are split
+        :param indices:     (list) the chunk indices, as given by MulticastSession.get_chunks_indices
+        :param video_path:  (str) the folder of the compressed videos
+        :param boundaries:  (dict) file ID --> chunk boundaries, e.g. from a placement artifact; computed from the file size when
+                            missing or when they do not match it
+        '''
+        self.indices = indices
+        self.subfile_ids = {ind: i for i, ind in enumerate(indices)}
+        self.paths = {}
+        self.sizes = {}
+        self.views = {}
+        for f in session.get_library():
+            path = os.path.join(video_path, f["compressed_path"])
+            try:
+                view = self._map(path)
+            except Exception as e:
+                custom_logger(f"[Error] Unable to map video {f['compressed_path']}: {e}", level="error")
+                continue
+            file_boundaries = (boundaries or {}).get(f["id"])
+            if file_boundaries is None or len(file_boundaries) != len(indices) + 1 or file_boundaries[-1] != len(view):
+                file_boundaries = session.get_subfile_boundaries(len(view))
+            self.paths[f["id"]] = path
+            self.sizes[f["id"]] = len(view)
+            self.views[f["id"]] = FileChunks(view, self.subfile_ids, file_boundaries)
+
+    @classmethod
+    def shared(cls, session, indices, video_path=VIDEO_PATH, boundaries=None):
+        '''
+        Returns the store of the process for the given library and indices, creating it on first use,
+        so that all the multicast groups served by the process share the same mappings.
+        '''
+        key = (tuple(f["compressed_path"] for f in session.get_library()), tuple(indices), video_path)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(session, indices, video_path, boundaries)
+            return cls._shared[key]
+
+    def _map(self, path):
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return memoryview(b"")
+            return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def get_location(self, file_id, index):
+        '''
+        :return:    (tuple) the (offset, length) of the chunk in the file
+        '''
+        return self.views[file_id].get_location(index)
+
+    def get_file_size(self, file_id):
+        return self.sizes.get(file_id, 0)
+
+    def get_file_chunks(self):
+        '''
+        :return:    (dict) file ID --> FileChunks, {index: memoryview}
+        '''
+        return self.views
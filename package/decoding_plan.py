@@ -0,0 +1,114 @@
+from collections import defaultdict
+from package.multicast_session import MulticastSession
+from common.xor_engine import xor_bytes
+
+
+def get_session_from_descriptor(descriptor):
+    '''
+    :return:    (MulticastSession) the session of the server, rebuilt from the parameters of its session descriptor
+    '''
+    session = MulticastSession(library=[None] * descriptor["nb_files"], receivers=list(range(descriptor["nb_receivers"])),
+                               cache_capacity=descriptor["cache_capacity"], group_size=descriptor.get("group_size"))
+    session.check_parameters()
+    return session
+
+
+class DecodingPlan:
+    '''
+    What each coded packet of a transmission gives to one receiver, computed before the packets arrive:
+    for every useful packet, the subfile it yields and the cached subfiles to XOR out of it.
+    Decoding a packet is then a dictionary lookup per operand instead of a search through the cache.
+    '''
+
+    def __init__(self, steps, combined_steps=None):
+        '''
+        :param steps:           (dict) packet ID --> (target (file ID, subfile index), list of the cached (file ID, subfile index) operands)
+        :param combined_steps:  (list) tuples (target, packet IDs, cached operands) of the subfiles carried by a transmission that was
+                                not sent, rebuilt as the XOR of the given packets
+        '''
+        self.steps = steps
+        self.combined_steps = combined_steps or []
+        self.waiting = defaultdict(list)  # packet ID --> positions of the combined steps using it
+        for position, (_, packet_ids, _) in enumerate(self.combined_steps):
+            for packet_id in packet_ids:
+                self.waiting[packet_id].append(position)
+
+    @staticmethod
+    def get_step(xor_packet, cache_index, file_id):
+        '''
+        :return:    (tuple) (target, cached operands) if the receiver gets a subfile of its file from the transmission, None otherwise
+        '''
+        cached, unknown = [], []
+        for fc in xor_packet:
+            if fc[0] == 'na':
+                continue  # Placeholder of a user without request
+            key = (int(fc[0]), tuple(fc[1]))
+            (cached if key in cache_index else unknown).append(key)
+        # A packet is decodable when all its operands but one are cached
+        if len(unknown) == 1 and unknown[0][0] == file_id:
+            return unknown[0], cached
+        return None
+
+    @classmethod
+    def from_transmissions(cls, list_of_xor_packets, cache_index, file_id, redundant=()):
+        '''
+        :param list_of_xor_packets: (list) the XOR schedule, as given by MulticastSession.get_list_of_xor_packets_for_transmission
+        :param cache_index:         (dict) the cache of the receiver, (file ID, subfile index) --> subfile
+        :param file_id:             (int) the file requested by the receiver
+        :param redundant:           (list) the transmissions that were not sent, as given by MulticastSession.get_demand_aware_xor_packets
+
+        :return:    (DecodingPlan) the plan, with only the packets that yield a missing subfile of the requested file
+        '''
+        steps = {}
+        for packet_id, xor_packet in enumerate(list_of_xor_packets):
+            step = cls.get_step(xor_packet, cache_index, file_id)
+            if step:
+                steps[packet_id] = step
+        combined_steps = []
+        for xor_packet, packet_ids in redundant:
+            step = cls.get_step(xor_packet, cache_index, file_id)
+            if step:
+                combined_steps.append((step[0], packet_ids, step[1]))
+        return cls(steps, combined_steps)
+
+    @classmethod
+    def from_session_descriptor(cls, descriptor, cache_index, file_id):
+        '''
+        Rebuilds the XOR schedule of the server from the session parameters of the descriptor (see MulticastServer.get_session_descriptor).
+        Servers sending the demand-aware schedule announce it with "leader_pruning".
+        '''
+        session = get_session_from_descriptor(descriptor)
+        requested_files = {int(user): file for user, file in descriptor["requested_files"].items()}
+        if "leader_pruning" in descriptor:
+            sent, redundant = session.get_demand_aware_xor_packets(requested_files, descriptor["leader_pruning"])
+            return cls.from_transmissions(sent, cache_index, file_id, redundant)
+        return cls.from_transmissions(session.get_list_of_xor_packets_for_transmission(requested_files), cache_index, file_id)
+
+    def __contains__(self, packet_id):
+        return packet_id in self.steps or packet_id in self.waiting
+
+    def __len__(self):
+        return len(self.steps) + len(self.combined_steps)
+
+    def decode(self, packet_id, payload, target_length, cache_index):
+        '''
+        :param packet_id:       (int) the packet ID
+        :param payload:         (bytes-like) the coded payload of the packet
+        :param target_length:   (int) the length of the subfile yielded by the packet, None to keep the payload length
+        :param cache_index:     (dict) the cache of the receiver, (file ID, subfile index) --> subfile
+
+        :return:    (tuple) (target (file ID, subfile index), decoded subfile (bytes))
+        '''
+        target, cached = self.steps[packet_id]
+        # Operands are zero-padded to the longest one, trim back to the size of the wanted subfile
+        return target, xor_bytes(payload, *(cache_index[key] for key in cached))[:target_length]
+
+    def decode_combined(self, position, payloads, target_length, cache_index):
+        '''
+        :param position:        (int) the position of the step in combined_steps
+        :param payloads:        (list) the coded payloads of the packets of the step
+
+        :return:    (tuple) (target (file ID, subfile index), decoded subfile (bytes))
+        '''
+        target, _, cached = self.combined_steps[position]
+        return target, xor_bytes(*payloads, *(cache_index[key] for key in cached))[:target_length]
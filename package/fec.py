@@ -0,0 +1,124 @@
+'''
+Systematic Reed-Solomon erasure code over GF(2^8), built on a Cauchy matrix.
+
+A block of k data fragments of equal length is protected by m parity fragments, parity i being
+XOR_j C[i][j] * data[j] with C[i][j] = 1 / (x_i + y_j), x_i = k + i and y_j = j. Any k fragments out of the
+k + m are enough to recover the block, as every square submatrix of a Cauchy matrix is invertible.
+
+Multiplying a whole fragment by a constant is a single bytes.translate() with a precomputed table,
+the sums are done by the XOR engine.
+'''
+import math
+from functools import lru_cache
+from common.xor_engine import xor_bytes
+
+MAX_BLOCK_FRAGMENTS = 256  # k + m, the size of the field
+
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d  # x^8 + x^4 + x^3 + x^2 + 1
+for _i in range(255, 512):
+    GF_EXP[_i] = GF_EXP[_i - 255]
+
+
+def get_nb_parity(block_size, ratio):
+    '''
+    :return:    (int) the number of parity fragments protecting a block of block_size data fragments for the given redundancy ratio
+    '''
+    return math.ceil(block_size * ratio) if ratio > 0 else 0
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_inv(a):
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return GF_EXP[255 - GF_LOG[a]]
+
+
+MUL_TABLES = [bytes(gf_mul(c, x) for x in range(256)) for c in range(256)]
+
+
+def gf_scale(fragment, coefficient):
+    '''
+    :return:    (bytes) the fragment multiplied by the coefficient, byte per byte
+    '''
+    if coefficient == 1:
+        return fragment
+    return bytes(fragment).translate(MUL_TABLES[coefficient])
+
+
+@lru_cache(maxsize=None)
+def cauchy_matrix(k, m):
+    if k + m > MAX_BLOCK_FRAGMENTS:
+        raise ValueError(f"A block holds at most {MAX_BLOCK_FRAGMENTS} fragments, got {k} data + {m} parity")
+    return tuple(tuple(gf_inv((k + i) ^ j) for j in range(k)) for i in range(m))
+
+
+def gf_invert_matrix(matrix):
+    '''
+    Inverts a square matrix over GF(256) with the Gauss-Jordan elimination.
+    '''
+    n = len(matrix)
+    rows = [list(row) + [1 if i == j else 0 for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if rows[r][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        inverse = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(inverse, value) for value in rows[col]]
+        for r in range(n):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [value ^ gf_mul(factor, pivot_value) for value, pivot_value in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+def encode_parity(fragments, nb_parity):
+    '''
+    Computes the parity fragments of a block.
+
+    :param fragments:   (list) the k data fragments (bytes-like), shorter fragments are zero-padded to the longest one
+    :param nb_parity:   (int) the number m of parity fragments
+
+    :return:    (list) the m parity fragments (bytes), of the length of the longest data fragment
+    '''
+    matrix = cauchy_matrix(len(fragments), nb_parity)
+    fragments = [bytes(fragment) for fragment in fragments]
+    return [xor_bytes(*(gf_scale(fragment, coefficient) for fragment, coefficient in zip(fragments, row))) for row in matrix]
+
+
+def recover(k, nb_parity, fragments, parities):
+    '''
+    Recovers the missing data fragments of a block.
+
+    :param k:           (int) the number of data fragments of the block
+    :param nb_parity:   (int) the number of parity fragments of the block
+    :param fragments:   (dict) the received data fragments, position in the block --> bytes-like
+    :param parities:    (dict) the received parity fragments, parity index --> bytes-like
+                        (data fragments shorter than the parity fragments are zero-padded)
+
+    :return:    (dict) position in the block --> recovered data fragment (bytes), for every missing data fragment
+    '''
+    missing = [j for j in range(k) if j not in fragments]
+    if not missing:
+        return {}
+    if len(parities) < len(missing):
+        raise ValueError(f"{len(missing)} missing fragments but only {len(parities)} parity fragments")
+
+    matrix = cauchy_matrix(k, nb_parity)
+    rows = sorted(parities)[:len(missing)]
+    # parity_i + sum of the known terms = sum over the missing j of C[i][j] * data[j]
+    syndromes = [xor_bytes(parities[i], *(gf_scale(fragment, matrix[i][j]) for j, fragment in fragments.items())) for i in rows]
+    inverse = gf_invert_matrix([[matrix[i][j] for j in missing] for i in rows])
+    return {j: xor_bytes(*(gf_scale(syndrome, coefficient) for syndrome, coefficient in zip(syndromes, inverse[n])))
+            for n, j in enumerate(missing)}
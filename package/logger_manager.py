@@ -1,38 +1,148 @@
+import atexit
 import json
 import os
+import queue
+import threading
 from typing import Union, List
 from common.config import SIMULATION_OUTPUT_PATH
+
+
+def get_simulation_path(sim_id: str) -> str:
+    """Path of the base document of a simulation, written once when the simulation is created."""
+    return os.path.join(SIMULATION_OUTPUT_PATH, f"{sim_id}.json")
+
+
+def get_log_path(sim_id: str) -> str:
+    """Path of the append-only log of a simulation: one JSON line {"keys", "value", "append"} per update."""
+    return os.path.join(SIMULATION_OUTPUT_PATH, f"{sim_id}.log.jsonl")
+
+
+def get_index_path() -> str:
+    """Path of the append-only index of the simulations: one JSON line per creation or status change, see SimulationIndex."""
+    return os.path.join(SIMULATION_OUTPUT_PATH, "simulations.index.jsonl")
+
+
+def apply_update(data: dict, keys: List[str], new_value, append=False):
+    """Applies an update to the simulation document, see LoggerManager.update."""
+    for key in keys[:-1]:
+        if key not in data or not isinstance(data[key], dict):
+            data[key] = {}
+        data = data[key]
+
+    final_key = keys[-1]
+    if append:
+        # If the final key exists and is an array, append the new value
+        if final_key in data and isinstance(data[final_key], list):
+            data[final_key].append(str(new_value))
+        else:
+            # If the key doesn't exist or isn't a list, initialize it as a list
+            data[final_key] = [str(new_value)]
+    else:
+        # Otherwise, just set the new value normally
+        data[final_key] = str(new_value)
+
+
+def load_simulation(sim_id: str) -> dict:
+    """Assembles the simulation document: the base document, with the updates of the log applied in order.
+
+    Raises:
+        FileNotFoundError: if the simulation does not exist
+    """
+    with open(get_simulation_path(sim_id), "r") as f:
+        data = json.load(f)
+    try:
+        with open(get_log_path(sim_id), "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Last line of a process killed in the middle of a write
+                apply_update(data, record["keys"], record["value"], record["append"])
+    except FileNotFoundError:
+        pass
+    return data
+
+
+class LogWriter:
+    """Background writer of a log file, shared by all the LoggerManager of the process writing to it.
+
+    The lines queued while a batch is written go in the next batch, appended with a single write and fsynced,
+    so the writes of the processes logging to the same file (O_APPEND) do not interleave within a line.
+    """
+    _writers = {}
+    _writers_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lines = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get(cls, path: str) -> "LogWriter":
+        """Returns the writer of the log file, creating it on first use."""
+        with cls._writers_lock:
+            if not cls._writers:
+                atexit.register(cls.flush_all)
+            if path not in cls._writers:
+                cls._writers[path] = cls(path)
+            return cls._writers[path]
+
+    @classmethod
+    def flush_all(cls):
+        with cls._writers_lock:
+            writers = list(cls._writers.values())
+        for writer in writers:
+            writer.flush()
+
+    def write(self, record: dict):
+        self.lines.put(json.dumps(record) + "\n")
+
+    def flush(self):
+        """Waits until every queued line is on disk."""
+        self.lines.join()
+
+    def run(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        while True:
+            batch = [self.lines.get()]
+            while True:
+                try:
+                    batch.append(self.lines.get_nowait())
+                except queue.Empty:
+                    break
+            data = memoryview("".join(batch).encode("utf-8"))
+            while data:
+                data = data[os.write(fd, data):]
+            os.fsync(fd)
+            for _ in batch:
+                self.lines.task_done()
+
+
 class LoggerManager:
     def __init__(self, sim_id: str):
         self.sim_id = sim_id
-        self.file_path = os.path.join(SIMULATION_OUTPUT_PATH, f"{sim_id}.json")
+        self.file_path = get_simulation_path(sim_id)
         self._ensure_file_exists()  # Ensure file is created if it doesn't exist
-        self.data = self._load_json()
+        self.writer = LogWriter.get(get_log_path(sim_id))
 
     def _ensure_file_exists(self):
         """Ensure that the JSON file exists. If it doesn't, create an empty one."""
         if not os.path.exists(self.file_path):
             os.makedirs(os.path.dirname(self.file_path), exist_ok=True)  # Create folder if it doesn't exist
-            with open(self.file_path, "w") as f:
-                json.dump({}, f, indent=4)  # Create an empty JSON file
-            print(f"File created at {self.file_path}")
-
-    def _load_json(self) -> dict:
-        """Load the JSON data from the file, or initialize an empty dict if the file does not exist."""
-        try:
-            with open(self.file_path, "r") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            raise ValueError(f"Error decoding JSON from file {self.file_path}")
-
-    def _save_json(self):
-        """Save the current data to the JSON file."""
-        with open(self.file_path, "w") as f:
-            json.dump(self.data, f, indent=4)
+            try:
+                with open(self.file_path, "x") as f:
+                    json.dump({}, f, indent=4)  # Create an empty JSON file
+                print(f"File created at {self.file_path}")
+            except FileExistsError:
+                pass  # Created by another process in the meantime
 
     def update(self, keys: Union[str, List[str]], new_value, append=False):
         """Update the JSON data with the given keys and new value.
-        
+
+        The update is appended to the log of the simulation by the background writer, the document is assembled on read
+        (see load_simulation).
+
         Args:
             keys (Union[str, List[str]]): A key or list of keys specifying the path to the value.
             new_value: The new value to set.
@@ -40,28 +150,10 @@ class LoggerManager:
         """
         if isinstance(keys, str):
             keys = keys.split("][")
+        self.writer.write({"keys": list(keys), "value": str(new_value), "append": append})
+        if list(keys) == ["status"]:
+            self.update_index({"status": str(new_value)})
 
-        data = self.data
-        
-        # Navigate through the keys to the final level
-        for key in keys[:-1]:
-            if key not in data or not isinstance(data[key], dict):
-                data[key] = {}
-            data = data[key]
-
-        # Check if the final key points to an array
-        final_key = keys[-1]
-        if append:
-            # If the final key exists and is an array, append the new value
-            if final_key in data and isinstance(data[final_key], list):
-                data[final_key].append(str(new_value))
-            else:
-                # If the key doesn't exist or isn't a list, initialize it as a list
-                data[final_key] = [str(new_value)]
-        else:
-            # Otherwise, just set the new value normally
-            data[final_key] = str(new_value)
-
-        # Save the updated JSON
-        self._save_json()
-
+    def update_index(self, fields: dict):
+        """Records fields of the simulation (status, created, nb_receivers) in the index of the simulations."""
+        LogWriter.get(get_index_path()).write({"id": self.sim_id, **fields})
@@ -1,35 +1,105 @@
 import json
-import os
+import queue
 import socket
 import struct
 import time
 import threading
-from collections import defaultdict
+from math import comb
+from collections import Counter, defaultdict
 from package.multicast_session import MulticastSession
+from package.chunk_store import ChunkStore
+from package.placement import UsersCacheView
+from package.placement_artifact import load_placement_artifact
+from package.parallel_encoder import ParallelEncoder
 from package.logger_manager import LoggerManager
-from common.utils import custom_logger, encode_packet, split_into_chunks, xor
-from common.config import VIDEO_PATH
+from package.session_state import DELIVERY, DONE, READY, REPAIR, SessionState
+from package.wire_format import FEC_HEADER, HEADER, REPAIR_FRAME, REPAIR_ROUNDS, get_session_id, iter_data_fragments, iter_end_fragments, iter_parity_fragments, iter_session_fragments
+from package.fec import encode_parity, get_nb_parity
+from package.udp_sender import DEFAULT_MTU, PacedSender, get_datagram_size
+from common.utils import custom_logger, encode_packet, split_into_chunks
+from common.xor_engine import xor_bytes
 
-BUFFER_SIZE = 1024  # 1 MB buffer size
+BUFFER_SIZE = 1024  # Datagram size of the legacy JSON format, the receivers of this format read 1 KB at a time
+PACKET_QUEUE_SIZE = 32  # Coded packets buffered between the encoder and the sender
+END_REPEAT = 3
+SESSION_REPEAT = 3  # Copies of the SESSION packet before the DATA packets, one more is sent before the END packet
+FEC_BLOCK_SIZE = 32  # Data fragments protected together by the parity fragments
+REPAIR_TIMEOUT = 30  # Seconds to wait for the NACKs of all the receivers
+REPAIR_MULTICAST_THRESHOLD = 2  # Packets missed by at least this number of receivers are re-multicast
+MIRROR = "mirror"  # Every group carries all the packets
+STRIPE = "stripe"  # Packet i is only sent on group i modulo the number of groups
+BINARY = "binary"  # Wire format of package.wire_format
+# Debug only: readable JSON datagrams, without repair or FEC. The placement goes through the binary placement protocol, so only
+# the receivers of this version decode it, the receivers of the former JSON protocol cannot join a session
+JSON_DEBUG = "json_debug"
+WIRE_FORMATS = [BINARY, JSON_DEBUG]
+READY_TIMEOUT = 5  # Seconds to wait for the READY of the receivers once they all got their cache
 
-class MulticastServer:
-    def __init__(self, sim_id, multicast_group, files, receivers, cache_capacity, requested_files, nb_receivers):
+
+class GroupSender:
+    '''
+    Transmission state of a multicast group: its socket and paced sender, and the queue of the coded packets to send on it,
+    filled by the producer of the server.
+    '''
+
+    def __init__(self, index, multicast_group, packet_queue_size=PACKET_QUEUE_SIZE, rate_mbps=0, rate_pps=0, sndbuf=0, mtu=DEFAULT_MTU):
+        '''
+        :param index:           (int) the position of the group in the configuration, the receivers join the groups in the same order
+        :param multicast_group: (tuple) the (address, port) of the group
+        '''
+        self.index = index
         self.multicast_group = multicast_group
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        ttl = struct.pack('b', 1)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sender = PacedSender(self.sock, multicast_group, rate_mbps, rate_pps, sndbuf=sndbuf, mtu=mtu)
+        self.packet_queue = queue.Queue(maxsize=packet_queue_size)  # (packet ID, packet), None at the end
+        self.fec_stats = {"data_fragments": 0, "parity_fragments": 0, "encode_time": 0}
+
+
+class MulticastServer:
+    '''
+    Serves a session on all the configured multicast groups at once: the session, the chunk store and the coded packets are
+    built once, and each group has its own sender thread. The packets are either striped across the groups or mirrored on each.
+    '''
+    def __init__(self, sim_id, multicast_groups, files, receivers, cache_capacity, requested_files, nb_receivers, encoding_workers=1, packet_queue_size=PACKET_QUEUE_SIZE, chunk_store=None, wire_format=BINARY, fec_ratio=0, fec_block_size=FEC_BLOCK_SIZE, rate_mbps=0, rate_pps=0, mtu=DEFAULT_MTU, sndbuf=0, group_size=None, group_mode=STRIPE, placement_file=None):
+        if isinstance(multicast_groups, tuple):
+            multicast_groups = [multicast_groups]  # A single (address, port) group
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format {wire_format}, expected one of {WIRE_FORMATS}")
         self.files = files
         self.receivers = receivers
         self.logger_manager = LoggerManager(sim_id)
-        self.session = MulticastSession(library=files, receivers=receivers, cache_capacity=cache_capacity)
-        self.indices = self.session.get_chunks_indices()
-        self.caches = self.session.get_indices_per_user_cache(self.indices)
+        self.state = SessionState(self.logger_manager)
+        self.session = MulticastSession(library=files, receivers=receivers, cache_capacity=cache_capacity, group_size=group_size)
+        # Read from the placement artifact when it is up to date, instead of recomputing the indices, chunk boundaries and caches
+        artifact = load_placement_artifact(placement_file, self.session)
+        self.indices = artifact.indices
+        self.placement = artifact.get_placement_index()
+        self.subfile_ids = self.placement.subfile_ids
+        self.chunk_store = chunk_store if chunk_store else ChunkStore.shared(self.session, self.indices, boundaries=artifact.get_boundaries(files))
         self.chunked_files = self.split_chunks_videos()
         # self.chunked_files = self.split_chunks()
-        self.caches_with_files = defaultdict(dict)
-        self.transmitted_packets = []
+        # Created once: the unicast server keeps this object from get_users_cache, before start() is called
+        self.caches_with_files = UsersCacheView(self.files, self.chunked_files, self.placement)
         self.requested_files = requested_files
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        ttl = struct.pack('b', 1)
-        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.groups = [GroupSender(i, group, packet_queue_size, rate_mbps, rate_pps, sndbuf, mtu) for i, group in enumerate(multicast_groups)]
+        # The JSON datagrams carry no packet ID, each group is decoded on its own
+        self.group_mode = group_mode if wire_format != JSON_DEBUG else MIRROR
+        self.nb_packets = 0
         self.nb_receivers = nb_receivers
+        self.encoding_workers = encoding_workers
+        self.wire_format = wire_format
+        self.fec_ratio = fec_ratio
+        self.fec_block_size = fec_block_size
+        self.fragment_size = get_datagram_size(mtu) - HEADER.size
+        if fec_ratio > 0:
+            # Keeps the parity datagrams, which carry a FEC header, within the datagram size
+            self.fragment_size -= FEC_HEADER.size
+        self.list_of_xor_packets = []
+        self.session_id = get_session_id(sim_id)
+        self.repaired = defaultdict(set)  # (repair round, user ID) --> (packet ID, fragment index) repaired on any group
+        self.repair_lock = threading.Lock()
         
         
     def split_chunks(self):
@@ -54,101 +124,390 @@ class MulticastServer:
     def split_chunks_videos(self):
         '''
         Splits the videos into chunks and returns a dictionary with the chunks.
+        The chunks are memoryview slices of the memory-mapped videos of the shared chunk store, nothing is copied.
         '''
-        splitted = dict()
-        for f in self.files:
-            list_of_chunks = self.split_video(os.path.join(VIDEO_PATH, f["compressed_path"]))
-            if list_of_chunks:  # Check if the splitting was successful
-                splitted[f["id"]] = {ind: list_of_chunks[i] for i, ind in enumerate(self.indices)}
-            else:
-                custom_logger(f"[Error] Splitting failed for file: {f['compressed_path']}", level="error")
-        return splitted
+        return self.chunk_store.get_file_chunks()
 
-    def split_video(self, file_path):
-        """Split the video into n equal-sized chunks."""
-        try:
-            video_size = os.path.getsize(file_path)
-            chunk_size = video_size // len(self.indices)  # Integer division
-
-            with open(file_path, 'rb') as video:
-                chunks = []
-                for i, _ in enumerate(self.indices):
-                    if i == len(self.indices) - 1:  
-                        # For the last chunk, read the remainder of the video
-                        chunk = video.read()
-                    else:
-                        chunk = video.read(chunk_size)
-                    chunks.append(chunk)
-                return chunks
-            
-        except Exception as e:
-            custom_logger(f"[Error] Unable to split video:{str(e)}", level="error")
-            return None
     def update_cache_with_files(self):
-        for user in range(1, self.session.nb_receivers + 1):
-            for i, f in enumerate(self.files):
-                fileID = i + 1
-                self.caches_with_files[user][fileID] = {k: v for k, v in self.chunked_files[f["id"]].items() if k in self.caches[user]}
+        '''
+        The caches of the users are views over the chunks, filtered by the placement index: user --> file ID --> {subfile index: chunk}.
+        The view is updated in place, so the holders of get_users_cache() see the current chunks.
+        '''
+        self.caches_with_files.files = self.files
+        self.caches_with_files.file_chunks = self.chunked_files
+        self.caches_with_files.placement = self.placement
     
     def get_users_cache(self):
         return self.caches_with_files
     
-    def generate_transmitted_packets(self):
-        list_of_xor_packets = self.session.get_list_of_xor_packets_for_transmission(self.requested_files)
-        self.transmitted_packets = []
-        
-        for _, xor_packet in enumerate(list_of_xor_packets):
-            packet = None
-            packet_obj = {}
-            for j, fc in enumerate(xor_packet):
-                try:
-                    fileID = int(fc[0])-1  # Ensure fileID is an integer
-                    chunkID = fc[1]
-                    chunk = self.chunked_files[self.files[fileID]["id"]][chunkID]
-                    if j == 0:
-                        packet = chunk
-                    else:
-                        packet = xor(packet, chunk)
-                except (ValueError, KeyError, TypeError) as e:
-                    custom_logger(f"Error processing packet: {e}", level="error")
-                    continue
-            packet_obj["indices"] = xor_packet
-            packet_obj["value"] = packet
-            self.transmitted_packets.append(packet_obj)
-        self.transmitted_packets[0]["all_indices"] = self.indices
-
-
-    def send_packets(self):
-            for packet in self.transmitted_packets:
+    def get_packet_operands(self, xor_packet):
+        '''
+        Resolves the chunks to XOR for a transmission.
+
+        :param xor_packet:  (list) the (file, chunk index) tuples of the transmission, as given by the session
+
+        :return:    (list) the (file ID, chunk ID) key of each operand, None for the operands that cannot be resolved (e.g., ('na', 'na'))
+        '''
+        keys = []
+        for fc in xor_packet:
+            try:
+                fileID = int(fc[0])-1  # Ensure fileID is an integer
+                chunkID = fc[1]
+                file_id = self.files[fileID]["id"]
+                if chunkID not in self.chunked_files[file_id]:
+                    raise KeyError(chunkID)
+                keys.append((file_id, chunkID))
+            except (ValueError, KeyError, TypeError, IndexError) as e:
+                custom_logger(f"Error processing packet: {e}", level="error")
+                keys.append(None)
+        return keys
+
+    def get_chunk(self, key):
+        return self.chunked_files[key[0]][key[1]]
+
+    def encode_packet_value(self, operands):
+        chunks = [self.get_chunk(key) for key in operands if key]
+        if len(chunks) == 1:
+            # Nothing to XOR, send the chunk view as is
+            return chunks[0]
+        return xor_bytes(*chunks)
+
+    def iter_transmitted_packets(self):
+        '''
+        Lazily generates the coded packets from the XOR schedule of the session, in transmission order.
+        The first packet also carries "all_indices", needed by the receivers to reassemble the files.
+        '''
+        list_of_xor_packets, redundant = self.session.get_demand_aware_xor_packets(self.requested_files, self.get_leader_pruning())
+        self.list_of_xor_packets = list_of_xor_packets
+        list_of_operands = [self.get_packet_operands(xor_packet) for xor_packet in list_of_xor_packets]
+        self.report_pruning(list_of_operands, redundant)
+
+        if self.encoding_workers > 1:
+            encoder = ParallelEncoder(self.chunk_store, self.encoding_workers)
+            values = encoder.encode([[key for key in operands if key] for operands in list_of_operands])
+        else:
+            values = (self.encode_packet_value(operands) for operands in list_of_operands)
+
+        for i, (xor_packet, operands, value) in enumerate(zip(list_of_xor_packets, list_of_operands, values)):
+            packet_obj = self.build_packet(xor_packet, operands, value)
+            if i == 0:
+                packet_obj["all_indices"] = self.indices
+            yield packet_obj
+
+    def get_leader_pruning(self):
+        '''
+        Only the binary receivers rebuild the transmissions skipped by the leader-based scheme, from the session descriptor.
+        '''
+        return self.wire_format != JSON_DEBUG
+
+    def report_pruning(self, list_of_operands, redundant):
+        '''
+        Logs the transmissions and bytes saved by the demand-aware schedule compared to sending every (t+1)-subset.
+
+        :param list_of_operands:    (list) the operands of the sent transmissions, as given by get_packet_operands
+        :param redundant:           (list) the skipped redundant transmissions, as given by MulticastSession.get_demand_aware_xor_packets
+        '''
+        nb_subsets = self.session.get_nb_groups() * sum(comb(self.session.group_size, t + 1) for t, _ in self.session.get_layers())
+        nb_empty = nb_subsets - len(list_of_operands) - len(redundant)
+        sent_bytes = sum(max((len(self.get_chunk(key)) for key in operands if key), default=0) for operands in list_of_operands)
+        saved_bytes = sum(max((len(self.get_chunk(key)) for key in self.get_packet_operands(xor_packet) if key), default=0) for xor_packet, _ in redundant)
+        message = (f"Demand-aware schedule: {len(list_of_operands)} of {nb_subsets} transmissions sent ({sent_bytes} bytes), "
+                   f"{len(redundant)} redundant and {nb_empty} without request skipped, {saved_bytes} bytes saved")
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="info")
+
+    def build_packet(self, xor_packet, operands, value):
+        packet_obj = {}
+        packet_obj["indices"] = xor_packet
+        packet_obj["lengths"] = [len(self.get_chunk(key)) if key else 0 for key in operands]
+        packet_obj["value"] = value
+        return packet_obj
+
+    def get_transmitted_packet(self, packet_id):
+        '''
+        Encodes again a single packet of the schedule, e.g. to repair it.
+
+        :param packet_id:   (int) the position of the packet in the transmission
+        '''
+        xor_packet = self.list_of_xor_packets[packet_id]
+        operands = self.get_packet_operands(xor_packet)
+        return self.build_packet(xor_packet, operands, self.encode_packet_value(operands))
+
+    def produce_packets(self):
+        '''
+        Producer stage of the pipeline: each packet is encoded once and fed to the bounded packet queue of its group (striping)
+        or of every group (mirroring), blocking while a sender is behind. None marks the end of the transmission.
+        '''
+        try:
+            for packet_id, packet in enumerate(self.iter_transmitted_packets()):
+                for group in self.get_packet_groups(packet_id):
+                    group.packet_queue.put((packet_id, packet))
+                self.nb_packets = packet_id + 1
+        except Exception as e:
+            custom_logger(f"Error generating packets: {e}", level="error")
+        finally:
+            for group in self.groups:
+                group.packet_queue.put(None)
+
+    def get_packet_groups(self, packet_id):
+        if self.group_mode == STRIPE:
+            return [self.groups[packet_id % len(self.groups)]]
+        return self.groups
+
+    def get_session_descriptor(self):
+        '''
+        :return:    (dict) the subfile indices and the session parameters, from which the receivers compute their decoding plan,
+                    and the size of each file of the library (by position), from which they lay out the decoded file
+        '''
+        return {"indices": self.indices, "nb_files": len(self.files), "nb_receivers": self.session.nb_receivers,
+                "cache_capacity": self.session.cache_capacity, "group_size": self.session.group_size, "requested_files": self.requested_files,
+                "leader_pruning": self.get_leader_pruning(), "group_mode": self.group_mode, "nb_groups": len(self.groups),
+                "file_sizes": [self.chunk_store.get_file_size(f["id"]) for f in self.files]}
+
+    def get_packet_descriptors(self, packet):
+        '''
+        :return:    (list) the (file ID, subfile ID, length) wire descriptors of the XORed subfiles of a packet, placeholders are dropped
+        '''
+        descriptors = []
+        for fc, length in zip(packet["indices"], packet["lengths"]):
+            if fc[1] in self.subfile_ids:
+                descriptors.append((int(fc[0]), self.subfile_ids[fc[1]], length))
+        return descriptors
+
+    def send_packets(self, group):
+        if self.wire_format == JSON_DEBUG:
+            self.send_json_packets(group)
+        else:
+            self.send_binary_packets(group)
+        group.sender.flush()
+        self.logger_manager.update("logs", f"Multicast transmission finished for group {group.multicast_group}", append=True)
+        custom_logger(f"Multicast transmission finished for group {group.multicast_group}", level="success")
+        self.report_send_rate(group)
+
+    def report_send_rate(self, group):
+        stats = group.sender.get_stats()
+        message = (f"Sent {stats['datagrams']} datagrams ({stats['bytes']} bytes) on {group.multicast_group} in {stats['time']:.3f} s: "
+                   f"{stats['pps']:.0f} pps, {stats['mbps']:.2f} Mbps")
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="info")
+
+    def send_binary_packets(self, group):
+        fragment_size = self.fragment_size
+        # Without the SESSION packet nothing can be decoded: it is repeated like the END packet, and NACKs can ask for it again
+        session_fragments = list(iter_session_fragments(self.session_id, self.get_session_descriptor(), fragment_size))
+        for _ in range(SESSION_REPEAT):
+            for buffers in session_fragments:
+                group.sender.send(buffers)
+
+        while True:
+            item = group.packet_queue.get()
+            if item is None:
+                break
+            packet_id, packet = item
+            fragments = list(self.iter_packet_fragments(packet_id, packet))
+            for buffers in fragments:
+                group.sender.send(buffers)
+            if self.fec_ratio > 0:
+                self.send_parity(group, packet_id, fragments, fragment_size)
+
+        for buffers in session_fragments:
+            group.sender.send(buffers)
+        # The END packet carries the number of packets of the whole transmission, it is repeated and receivers ignore the duplicates
+        for _ in range(END_REPEAT):
+            for buffers in iter_end_fragments(self.session_id, self.nb_packets, fragment_size):
+                group.sender.send(buffers)
+        self.report_fec(group)
+
+    def iter_packet_fragments(self, packet_id, packet):
+        return iter_data_fragments(self.session_id, packet_id, self.get_packet_descriptors(packet), packet["value"], self.fragment_size)
+
+    def send_parity(self, group, packet_id, fragments, fragment_size):
+        '''
+        Protects the data fragments of a packet, by blocks of fec_block_size fragments, with parity fragments (see package.fec).
+        '''
+        begin = time.perf_counter()
+        payloads = [b"".join(buffers[1:]) for buffers in fragments]
+        payloads[-1] = payloads[-1].ljust(fragment_size, b"\0")  # Parity fragments always have the full fragment size
+        nb_parity = get_nb_parity(self.fec_block_size, self.fec_ratio)
+        parities = []
+        for start in range(0, len(payloads), self.fec_block_size):
+            parities += encode_parity(payloads[start:start + self.fec_block_size], nb_parity)
+        group.fec_stats["encode_time"] += time.perf_counter() - begin
+
+        body_length = sum(len(buffer) for buffers in fragments for buffer in buffers[1:])
+        for buffers in iter_parity_fragments(self.session_id, packet_id, len(fragments), body_length, parities, self.fec_block_size, nb_parity):
+            group.sender.send(buffers)
+        group.fec_stats["data_fragments"] += len(fragments)
+        group.fec_stats["parity_fragments"] += len(parities)
+
+    def report_fec(self, group):
+        stats = group.fec_stats
+        if not stats["parity_fragments"]:
+            return
+        overhead = stats["parity_fragments"] / stats["data_fragments"] * 100
+        message = (f"FEC on {group.multicast_group}: {stats['parity_fragments']} parity fragments for {stats['data_fragments']} data fragments "
+                   f"(+{overhead:.1f}% overhead), encode time {stats['encode_time']:.3f} s")
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="info")
+
+    def repair(self, unicast_server, group):
+        '''
+        Repair rounds of a group, after its transmission: the first round waits for the NACKs of all the receivers, the next ones
+        for the NACKs of the receivers that still missed something, up to REPAIR_ROUNDS rounds.
+        '''
+        nb_receivers = self.nb_receivers
+        for repair_round in range(REPAIR_ROUNDS):
+            nb_receivers = self.repair_round(unicast_server, group, repair_round, nb_receivers)
+            if not nb_receivers:
+                break
+
+    def repair_round(self, unicast_server, group, repair_round, nb_receivers):
+        '''
+        Repair round of a group: waits for the NACKs of the receivers (sent over the unicast channel), then sends once every missing
+        fragment: re-multicast on the group when at least REPAIR_MULTICAST_THRESHOLD receivers miss it, unicast otherwise.
+        The receivers missing the session descriptor get the SESSION packet in unicast first.
+        A fragment already repaired for a receiver on another group during the round is not sent again.
+
+        :param repair_round:    (int) the round, from 0
+        :param nb_receivers:    (int) the number of NACKs to wait for
+
+        :return:    (int) the number of receivers that missed something, they send a NACK in the next round
+        '''
+        nacks = unicast_server.wait_for_nacks(group.multicast_group, repair_round, nb_receivers, REPAIR_TIMEOUT)
+        fragments = {}  # packet ID --> datagram buffers of its fragments
+        wanted = {user_id: self.get_requested_fragments(group, repair_round, nack, fragments) for user_id, (nack, _) in nacks.items()}
+        requests = Counter(key for keys in wanted.values() for key in keys)
+        multicast_keys = sorted(key for key, count in requests.items() if count >= REPAIR_MULTICAST_THRESHOLD)
+        sent_bytes, unicast_bytes = group.sender.nb_bytes, 0
+
+        for packet_id, index in multicast_keys:
+            group.sender.send(fragments[packet_id][index])
+        group.sender.flush()
+        multicast_bytes = group.sender.nb_bytes - sent_bytes
+
+        nb_sessions = 0
+        for user_id, (nack, client_socket) in nacks.items():
+            try:
+                datagrams = []
+                if nack.session:
+                    nb_sessions += 1
+                    datagrams += iter_session_fragments(self.session_id, self.get_session_descriptor(), self.fragment_size)
+                datagrams += (fragments[packet_id][index] for packet_id, index in sorted(wanted[user_id].difference(multicast_keys)))
+                for buffers in datagrams:
+                    datagram = b"".join(buffers)
+                    client_socket.sendall(REPAIR_FRAME.pack(len(datagram)) + datagram)
+                    unicast_bytes += len(datagram)
+                client_socket.sendall(REPAIR_FRAME.pack(0))  # End of the repair round
+            except OSError as e:
+                custom_logger(f"Unable to send the repair to {user_id}: {e}", level="error")
+            finally:
+                client_socket.close()
+
+        nb_packets = len({packet_id for packet_id, _ in requests})
+        message = (f"Repair round {repair_round + 1} on {group.multicast_group}: {len(nacks)} NACKs, {nb_sessions} session descriptors, "
+                   f"{len(requests)} missing fragments of {nb_packets} packets, {len(multicast_keys)} re-multicast ({multicast_bytes} bytes), "
+                   f"{len(requests) - len(multicast_keys)} unicast ({unicast_bytes} bytes)")
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="info")
+        return sum(1 for nack, _ in nacks.values() if nack.packets or nack.fragments or nack.session)
+
+    def get_requested_fragments(self, group, repair_round, nack, fragments):
+        '''
+        :param group:           (GroupSender) the group of the NACK
+        :param repair_round:    (int) the round of the NACK
+        :param nack:            (Nack) the NACK of a receiver
+        :param fragments:       (dict) packet ID --> datagram buffers of its fragments, filled with the requested packets
+
+        :return:    (set) the (packet ID, fragment index) to repair for the receiver: only the packets sent on the group when they
+                    are striped, and not those already repaired for this receiver on another group during the round
+        '''
+        requested = [(packet_id, None) for packet_id in nack.packets] + list(nack.fragments.items())
+        keys = set()
+        for packet_id, indices in requested:
+            if not 0 <= packet_id < self.nb_packets:
+                continue
+            if self.group_mode == STRIPE and packet_id % len(self.groups) != group.index:
+                continue
+            if packet_id not in fragments:
+                fragments[packet_id] = list(self.iter_packet_fragments(packet_id, self.get_transmitted_packet(packet_id)))
+            nb_fragments = len(fragments[packet_id])
+            keys.update((packet_id, index) for index in (range(nb_fragments) if indices is None else indices) if 0 <= index < nb_fragments)
+        with self.repair_lock:
+            keys.difference_update(self.repaired[repair_round, nack.receiver])
+            self.repaired[repair_round, nack.receiver].update(keys)
+        return keys
+
+    def send_json_packets(self, group):
+            while True:
+                item = group.packet_queue.get()
+                if item is None:
+                    break
+                _, packet = item
                 encoded_packet = encode_packet(packet)  # Encode the packet
                 packet_bytes = json.dumps(encoded_packet).encode('utf-8')  # Serialize the encoded packet to bytes
                 chunked_packets = split_into_chunks(packet_bytes, BUFFER_SIZE, last_packet=b"END_OF_CHUNK")
 
                 for chunk in chunked_packets:
-                    self.sock.sendto(chunk, self.multicast_group)
+                    group.sender.send([chunk])
                     
-            self.sock.sendto(b"LAST_PACKET", self.multicast_group)
-            self.logger_manager.update("logs", f"Multicast transmission finished for group {self.multicast_group}", append=True)
-            custom_logger(f"Multicast transmission finished for group {self.multicast_group}", level="success")
+            group.sender.send([b"LAST_PACKET"])
 
-    
-    def update_requests(self):
-        self.generate_transmitted_packets()
-    
-    def start(self, unicast_server):
+    def report_scheme(self):
+        session = self.session
+        layers = " + ".join(f"{fraction:.3f} x t={t}" for t, fraction in session.get_layers())
+        message = (f"Coded caching: K={session.nb_receivers}, t={session.t:g} ({layers}), {session.get_nb_groups()} group(s) of {session.group_size} users, "
+                   f"{session.get_subpacketization()} subfiles per file, delivery rate {session.get_delivery_rate():.3f} files "
+                   f"(lower convex envelope {session.get_rate_envelope():.3f})")
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="info")
+
+    def start(self, unicast_server, wait_for_receivers=True):
+        '''
+        Runs the session: waits for the placements and the READY of every receiver, woken by the unicast server as they arrive,
+        then sends the packets.
+
+        :param unicast_server:      (UnicastServer) the server of the caches and NACKs, None to only send the packets
+        :param wait_for_receivers:  (bool) whether to wait for every receiver to get its cache and join the groups before sending
+        '''
         self.update_cache_with_files()
-        threading.Thread(target=self.update_requests, args=()).start()
-        
-        if unicast_server:
-            while True:
-                if unicast_server.check_connections(self.nb_receivers):
-                    self.logger_manager.update("logs", f"Starting on {self.multicast_group}", append=True)
-                    custom_logger(f"Starting on {self.multicast_group}", level="info")
-                    time.sleep(5)
-                    self.send_packets()
-                    unicast_server.reset_connections()
-                    break
-        else:
-            custom_logger(f"Starting on {self.multicast_group}", level="info")
-            self.logger_manager.update("logs", f"Starting on {self.multicast_group}", append=True)
-            self.send_packets()
+        self.report_scheme()
+        threading.Thread(target=self.produce_packets, args=()).start()
+        addresses = ", ".join(str(group.multicast_group) for group in self.groups)
+
+        if unicast_server and wait_for_receivers:
+            unicast_server.wait_for_placements(self.nb_receivers)
+            unicast_server.report_placement()
+            self.state.advance(READY)
+            # A receiver that crashed or lost its connection after its placement never sends READY: the others are served anyway
+            if not unicast_server.wait_for_ready(self.nb_receivers, READY_TIMEOUT):
+                custom_logger(f"Not every receiver joined the multicast groups after {READY_TIMEOUT} s, starting anyway", level="warning")
+        self.logger_manager.update("logs", f"Starting on {addresses}", append=True)
+        custom_logger(f"Starting on {addresses}", level="info")
+        self.transmit(unicast_server)
+        if unicast_server and wait_for_receivers:
+            unicast_server.reset_connections()
+        self.state.report()
+
+    def transmit(self, unicast_server=None):
+        '''
+        Sends the packets on all the groups at the same time, one thread per group, then runs the repair round of each group.
+
+        :param unicast_server:  (UnicastServer) the server of the NACKs, None to skip the repair rounds
+        '''
+        self.state.advance(DELIVERY)
+        self.run_on_groups(self.send_packets)
+        if unicast_server and self.wire_format != JSON_DEBUG:
+            self.state.advance(REPAIR)
+            self.run_on_groups(self.repair, unicast_server)
+            unicast_server.close_repairs()
+        self.state.advance(DONE)
+
+    def run_on_groups(self, target, *args):
+        '''
+        Calls target(*args, group) for every group, each in its own thread, and waits for all of them.
+        '''
+        threads = [threading.Thread(target=target, args=(*args, group)) for group in self.groups]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
@@ -1,20 +1,33 @@
-from itertools import combinations
+from itertools import combinations, product
+from math import ceil, comb, floor
 
 class MulticastSession:
-    def __init__(self, library, receivers, cache_capacity):
+    '''
+    Coded caching scheme of a session. With a group size K' < K, the users are partitioned into ceil(K/K') groups of K'
+    consecutive IDs (the last one may be smaller) and the scheme runs with t=K'*M/N in every group: each file is split
+    into C(K', t) subfiles instead of C(K, t), for a delivery rate multiplied by about K/K'.
+    A subfile is cached by the users at the same positions in every group, its index lists all of them.
+    When t is not an integer, each file is split between the two neighbouring integers t0 < t < t0+1 (memory sharing):
+    a part t0+1-t of the file is cached and delivered with t0, the rest with t0+1, which achieves the lower convex
+    envelope of the rates of the integer values. The subfile indices of both layers are tuples of t0 and t0+1 users per group.
+    '''
+    def __init__(self, library, receivers, cache_capacity, group_size=None):
         self.library = library
         self.receivers = receivers
         self.nb_receivers = len(receivers)
         self.nb_items = len(library)
         self.cache_capacity = cache_capacity
+        self.group_size = group_size if group_size and group_size < self.nb_receivers else self.nb_receivers
         self.t = None
+        self.layers = None
 
     def get_library(self):
         return self.library
     
     def check_parameters(self):
         '''
-        Checks if the given parameters lead to a "valid" scenario, i.e., with integer t=K*g=K*M/N
+        Checks if the given parameters lead to a "valid" scenario, i.e., with 0 <= M <= N, and computes t=K'*g=K'*M/N (K'=K without groups)
+        and the layers of the files: a single one when t is an integer, two for memory sharing otherwise
         
         :param N:	(int) number of files
         :param K:	(int) number of users
@@ -23,12 +36,25 @@ class MulticastSession:
         :return:	True/False
         '''
         g = self.cache_capacity/self.nb_items
-        t = self.nb_receivers*g
+        t = self.group_size*self.cache_capacity/self.nb_items
+        if not 0 <= g <= 1:
+            return False
         if t.is_integer():
             self.t = int(t)
-            return True
+            self.layers = [(self.t, 1)]
         else:
-            return False
+            self.t = t
+            t0 = int(t)
+            self.layers = [(t0, t0 + 1 - t), (t0 + 1, t - t0)]
+        return True
+
+    def get_layers(self):
+        '''
+        :return:	(list) tuples (integer t of the layer, fraction of each file in the layer)
+        '''
+        if self.layers is None:
+            self.check_parameters()
+        return self.layers
 
     def get_chunks_indices(self):
         '''
@@ -43,13 +69,91 @@ class MulticastSession:
                     the size of the list (i.e., number of indices) is equal to the number of chunks that the files needs to be split 
         '''
         if self.check_parameters():
-            indices = list(combinations(range(1, self.nb_receivers + 1), self.t))
+            indices = [self.get_group_index(positions) for t, _ in self.layers for positions in combinations(range(1, self.group_size + 1), t)]
         else:
-            error_message = "t=K*M/N={} is not an integer, choose other parameters, e.g., M={}".format(self.nb_receivers * self.cache_capacity / self.nb_items, int(int(self.nb_receivers * self.cache_capacity / self.nb_items) * self.nb_items / self.nb_receivers))
+            error_message = "M={} is not between 0 and N={}, choose other parameters".format(self.cache_capacity, self.nb_items)
             raise Exception(error_message)
 
         return indices
 
+    def get_nb_groups(self):
+        return -(-self.nb_receivers // self.group_size)
+
+    def get_group_index(self, positions):
+        '''
+        :param positions:   (tuple) positions in a group, from 1 to K'
+
+        :return:    (tuple) the IDs of the users at these positions in all the groups, i.e., the index of the subfile they cache
+        '''
+        return tuple(g * self.group_size + p for g in range(self.get_nb_groups()) for p in positions if g * self.group_size + p <= self.nb_receivers)
+
+    def get_subpacketization(self):
+        '''
+        :return:	(int) the number of subfiles per file, C(K', t) per layer
+        '''
+        return sum(comb(self.group_size, t) for t, _ in self.get_layers())
+
+    def get_layer_rate(self, t):
+        '''
+        Calculates the load of the delivery phase with the integer t when all the users request a file, in number of files:
+        every group sends C(K', t+1) transmissions of one subfile, minus those with no user of the group (last group).
+
+        :return:	(float) the number of transmissions divided by the number of subfiles per file
+        '''
+        nb_transmissions = 0
+        for g in range(self.get_nb_groups()):
+            nb_users = min(self.group_size, self.nb_receivers - g * self.group_size)
+            nb_transmissions += comb(self.group_size, t + 1) - comb(self.group_size - nb_users, t + 1)
+        return nb_transmissions / comb(self.group_size, t)
+
+    def get_delivery_rate(self):
+        '''
+        :return:	(float) the load of the delivery phase when all the users request a file, in number of files, summed over the layers
+        '''
+        return sum(fraction * self.get_layer_rate(t) for t, fraction in self.get_layers())
+
+    def get_rate_envelope(self):
+        '''
+        :return:	(float) the lower convex envelope of the rates of the integer values of t, at the t of the session
+        '''
+        self.get_layers()
+        rates = [self.get_layer_rate(t) for t in range(self.group_size + 1)]
+        # Lowest chord between an integer below t and an integer above t
+        return min(rates[i] + (rates[j] - rates[i]) * (self.t - i) / (j - i) if j > i else rates[i]
+                   for i in range(floor(self.t) + 1) for j in range(ceil(self.t), self.group_size + 1))
+
+    def get_subfile_boundaries(self, file_size):
+        '''
+        Calculates where the chunks (subfiles) lie in a file: each layer takes its fraction of the file, split in equal-sized chunks,
+        the last chunk of a layer also takes the remainder of the layer
+
+        :param file_size:   (int) size of the file in bytes
+
+        :return:	(list) the subpacketization + 1 offsets delimiting the chunks, chunk i being [boundaries[i], boundaries[i + 1]),
+                    in the order of the indices of get_chunks_indices
+        '''
+        boundaries = []
+        layers = self.get_layers()
+        layer_offset = 0
+        for layer, (t, fraction) in enumerate(layers):
+            nb_chunks = comb(self.group_size, t)
+            layer_size = file_size - layer_offset if layer == len(layers) - 1 else int(file_size * fraction)
+            chunk_size = layer_size // nb_chunks  # Integer division
+            boundaries += [layer_offset + i * chunk_size for i in range(nb_chunks)]
+            layer_offset += layer_size
+        boundaries.append(file_size)
+        return boundaries
+
+    def get_subfile_layout(self, file_size, indices):
+        '''
+        :param file_size:   (int) size of the file in bytes
+        :param indices: (list) a list of tuples, where tuples correspond to indices
+
+        :return:	(list) a list of tuples (index, offset, length), in the order of the given indices (see get_subfile_boundaries)
+        '''
+        boundaries = self.get_subfile_boundaries(file_size)
+        return [(ind, boundaries[i], boundaries[i + 1] - boundaries[i]) for i, ind in enumerate(indices)]
+
     def get_indices_per_user_cache(self, indices):
         '''
         Calculates the list of indices (i.e., which chunks) that each user cache should contain
@@ -59,9 +163,10 @@ class MulticastSession:
 
         :return:	(dict) a dictionary with keys the user ID (from 1 to K) and values a list of indices (subset of the given list of indices)
         '''
-        caches = {}
-        for i in range(1, self.nb_receivers + 1):
-            caches[i] = [ind for ind in indices if i in ind]
+        caches = {i: [] for i in range(1, self.nb_receivers + 1)}
+        for ind in indices:
+            for i in ind:
+                caches[i].append(ind)
 
         return caches
     
@@ -83,17 +188,105 @@ class MulticastSession:
         '''
         list_of_xor_packets = []
         requesting_users = list(requested_files.keys())
-        all_users = list(range(1, self.nb_receivers + 1))
-        list_of_xor_combinations = list(combinations(all_users, self.t + 1))
-        for xor_combination in list_of_xor_combinations:
-            chunks_to_xor = []
-            for user in xor_combination:
-                if user in requesting_users:
-                    file = requested_files[user]
-                    chunk = tuple([i for i in xor_combination if i != user])
-                    chunks_to_xor.append((file, chunk))
-                else:
-                    chunks_to_xor.append(('na', 'na'))
-            list_of_xor_packets.append(chunks_to_xor)
+        group_positions = list(range(1, self.group_size + 1))
+        for t, _ in self.get_layers():
+            list_of_xor_combinations = list(combinations(group_positions, t + 1))
+            for g in range(self.get_nb_groups()):
+                first_user = g * self.group_size
+                for xor_combination in list_of_xor_combinations:
+                    if first_user + xor_combination[0] > self.nb_receivers:
+                        continue  # No user of the (last) group at these positions
+                    chunks_to_xor = []
+                    for position in xor_combination:
+                        user = first_user + position
+                        if user in requesting_users:
+                            file = requested_files[user]
+                            chunk = self.get_group_index(tuple([i for i in xor_combination if i != position]))
+                            chunks_to_xor.append((file, chunk))
+                        else:
+                            chunks_to_xor.append(('na', 'na'))
+                    list_of_xor_packets.append(chunks_to_xor)
         return list_of_xor_packets
     
+
+    def get_group_demands(self, requested_files, group):
+        '''
+        :param requested_files:	(dict) user ID --> file ID
+        :param group:	(int) the group, from 0
+
+        :return:	(dict) position in the group (from 1 to K') --> file ID requested by the user at this position, None without request or user
+        '''
+        first_user = group * self.group_size
+        return {p: requested_files.get(first_user + p) if first_user + p <= self.nb_receivers else None for p in range(1, self.group_size + 1)}
+
+    def get_group_leaders(self, demands):
+        '''
+        :param demands:	(dict) position --> file ID, as given by get_group_demands
+
+        :return:	(dict) file ID (None included) --> position of its leader, the first user of the group requesting it
+        '''
+        leaders = {}
+        for p in sorted(demands):
+            leaders.setdefault(demands[p], p)
+        return leaders
+
+    def get_group_transmission(self, positions, demands):
+        '''
+        :return:	(list) the (file, index) tuples XORed by the transmission to the users at the given positions of a group,
+                    without placeholders for the users without request
+        '''
+        return [(demands[p], self.get_group_index(tuple([i for i in positions if i != p]))) for p in positions if demands[p] is not None]
+
+    def get_leader_combinations(self, positions, demands, leaders):
+        '''
+        Lemma of Yu, Maddah-Ali and Avestimehr: with B the positions and the leaders, the XOR of the transmissions to B minus V,
+        over all the sets V with exactly one user per requested file, is zero. The transmission to positions (V = the leaders)
+        is then the XOR of the transmissions to B minus V for the other sets V, which all contain a leader.
+
+        :param positions:	(tuple) positions in the group without leader
+        :param leaders:	(dict) file ID --> position of its leader, as given by get_group_leaders
+
+        :return:	(generator) the positions of the transmissions whose XOR is the transmission to positions
+        '''
+        base = set(positions) | set(leaders.values())
+        members = [sorted(p for p in base if demands[p] == file) for file in leaders]
+        for combination in product(*members):
+            if set(combination) != set(leaders.values()):
+                yield tuple(sorted(base - set(combination)))
+
+    def get_demand_aware_xor_packets(self, requested_files, leader_pruning=True):
+        '''
+        Calculates the transmissions actually needed to serve the requests: the (t+1)-subsets without requesting user are skipped,
+        the placeholders of the users without request are dropped, and with leader_pruning, when several users request the same file,
+        only the subsets containing a leader are sent (scheme of Yu, Maddah-Ali and Avestimehr). The users rebuild every other
+        transmission as the XOR of sent ones.
+
+        :param requested_files:	(dict) a dictionary with the requests: format user ID (key) -->  file ID (value)
+        :param leader_pruning:	(bool) whether to skip the transmissions without leader
+
+        :return:	(tuple) the list of the transmissions to send, in the format of get_list_of_xor_packets_for_transmission,
+                    and the list of the skipped redundant transmissions, as tuples (transmission, list of the positions in the sent list
+                    of the transmissions whose XOR equals it)
+        '''
+        sent, redundant = [], []
+        for t, _ in self.get_layers():
+            list_of_xor_combinations = list(combinations(range(1, self.group_size + 1), t + 1))
+            for g in range(self.get_nb_groups()):
+                demands = self.get_group_demands(requested_files, g)
+                leaders = self.get_group_leaders(demands) if leader_pruning else {}
+                packet_ids = {}
+                skipped = []
+                for xor_combination in list_of_xor_combinations:
+                    chunks_to_xor = self.get_group_transmission(xor_combination, demands)
+                    if not chunks_to_xor:
+                        continue
+                    if leader_pruning and set(leaders.values()).isdisjoint(xor_combination):
+                        skipped.append((xor_combination, chunks_to_xor))
+                        continue
+                    packet_ids[xor_combination] = len(sent)
+                    sent.append(chunks_to_xor)
+                for xor_combination, chunks_to_xor in skipped:
+                    # The transmissions without requesting user are zero and not sent
+                    combination_ids = [packet_ids[c] for c in self.get_leader_combinations(xor_combination, demands, leaders) if c in packet_ids]
+                    redundant.append((chunks_to_xor, combination_ids))
+        return sent, redundant
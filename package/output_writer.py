@@ -0,0 +1,72 @@
+import os
+
+
+def get_cumulative_layout(indices, lengths):
+    '''
+    :param indices: (list) the subfile indices, in file order
+    :param lengths: (dict) subfile index --> length
+
+    :return:    (list) tuples (index, offset, length) of the subfiles laid out one after the other
+    '''
+    layout, offset = [], 0
+    for ind in indices:
+        layout.append((ind, offset, lengths[ind]))
+        offset += lengths[ind]
+    return layout
+
+
+class OutputWriter:
+    '''
+    Writes a file subfile by subfile, in any order: the file is preallocated at its final size and each subfile is
+    written at its offset as soon as it is available, so the file is never held in memory.
+    '''
+
+    def __init__(self, path, layout):
+        '''
+        :param path:    (str) the path of the output file
+        :param layout:  (list) tuples (subfile index, offset, length), as given by MulticastSession.get_subfile_layout
+        '''
+        self.path = path
+        self.locations = {ind: (offset, length) for ind, offset, length in layout}
+        self.file_size = max((offset + length for _, offset, length in layout), default=0)
+        self.written = set()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            if hasattr(os, "posix_fallocate") and self.file_size:
+                os.posix_fallocate(self.fd, 0, self.file_size)
+            else:
+                os.ftruncate(self.fd, self.file_size)
+        except OSError:
+            os.ftruncate(self.fd, self.file_size)  # The file system does not support fallocate
+
+    def write(self, index, data):
+        '''
+        :param index:   (tuple) the subfile index
+        :param data:    (bytes-like) the subfile
+        '''
+        offset, length = self.locations[index]
+        if len(data) != length:
+            raise ValueError(f"Subfile {index} has {len(data)} bytes, {length} expected")
+        if hasattr(os, "pwrite"):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view, offset = view[written:], offset + written
+        else:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            os.write(self.fd, data)
+        self.written.add(index)
+
+    def get_missing(self):
+        '''
+        :return:    (list) the indices of the subfiles not written yet
+        '''
+        return [ind for ind in self.locations if ind not in self.written]
+
+    def close(self, delete=False):
+        '''
+        :param delete:  (bool) whether to remove the file, e.g. when it could not be completed
+        '''
+        os.close(self.fd)
+        if delete:
+            os.remove(self.path)
@@ -0,0 +1,101 @@
+import mmap
+import multiprocessing
+from collections import deque
+from multiprocessing import shared_memory
+from common.xor_engine import xor_into
+
+BATCH_SIZE = 16  # Number of transmissions encoded by a worker in one task
+SLOTS_PER_WORKER = 2  # Number of output slots (batches in flight) per worker
+
+# Per worker process: the memory-mapped library files and the attached output segment (see _init_worker)
+_worker_state = {}
+
+
+def _init_worker(paths, output_name):
+    files = {}
+    for file_id, path in paths.items():
+        with open(path, 'rb') as file:
+            files[file_id] = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    _worker_state["files"] = files
+    _worker_state["output"] = shared_memory.SharedMemory(name=output_name)
+
+
+def _encode_batch(slot_offset, batch):
+    '''
+    Encodes a batch of transmissions inside a worker process.
+    The operands are read from the memory-mapped library files, which share the page cache of the server,
+    and each XOR is written in the shared output segment, so neither the chunks nor the coded packets go through pickle.
+
+    :param slot_offset: (int) the offset of the output slot of the batch
+    :param batch:       (list) tuples (offset in the slot, output length, list of operand locations (file ID, offset, length))
+
+    :return:    (int) the number of encoded transmissions
+    '''
+    files = _worker_state["files"]
+    dst = _worker_state["output"].buf
+    for out_offset, out_length, locations in batch:
+        operands = [files[file_id][offset:offset + length] for file_id, offset, length in locations]
+        start = slot_offset + out_offset
+        xor_into(dst[start:start + out_length], operands)
+    return len(batch)
+
+
+class ParallelEncoder:
+    def __init__(self, chunk_store, nb_workers, batch_size=BATCH_SIZE):
+        '''
+        :param chunk_store: (ChunkStore) the store of the chunks to XOR
+        :param nb_workers:  (int) the number of worker processes
+        :param batch_size:  (int) the number of transmissions per worker task
+        '''
+        self.chunk_store = chunk_store
+        self.nb_workers = nb_workers
+        self.batch_size = batch_size
+
+    def encode(self, transmissions):
+        '''
+        Encodes the transmissions on a process pool and yields the coded values in transmission order.
+        At most SLOTS_PER_WORKER batches per worker are in flight, so the output memory does not grow with the number of transmissions.
+
+        :param transmissions:   (list) for each transmission, the list of operand keys (file ID, chunk ID) to XOR
+
+        :return:    (generator) the coded value (bytes) of each transmission, zero-padded to its longest operand
+        '''
+        batches = []
+        slot_size = 0
+        for i in range(0, len(transmissions), self.batch_size):
+            batch = []
+            batch_size = 0
+            for operands in transmissions[i:i + self.batch_size]:
+                locations = [(file_id, *self.chunk_store.get_location(file_id, chunkID)) for file_id, chunkID in operands]
+                length = max((location[2] for location in locations), default=0)
+                batch.append((batch_size, length, locations))
+                batch_size += length
+            batches.append(batch)
+            slot_size = max(slot_size, batch_size)
+
+        nb_slots = self.nb_workers * SLOTS_PER_WORKER
+        output_shm = shared_memory.SharedMemory(create=True, size=max(slot_size * nb_slots, 1))
+        try:
+            with multiprocessing.Pool(self.nb_workers, initializer=_init_worker,
+                                      initargs=(self.chunk_store.paths, output_shm.name)) as pool:
+                free_slots = list(range(nb_slots))
+                in_flight = deque()
+                for batch in batches:
+                    if not free_slots:
+                        free_slots.append((yield from self._collect(output_shm, slot_size, in_flight.popleft())))
+                    slot = free_slots.pop()
+                    in_flight.append((slot, batch, pool.apply_async(_encode_batch, (slot * slot_size, batch))))
+                while in_flight:
+                    yield from self._collect(output_shm, slot_size, in_flight.popleft())
+        finally:
+            output_shm.close()
+            output_shm.unlink()
+
+    def _collect(self, output_shm, slot_size, job):
+        slot, batch, result = job
+        result.get()
+        slot_offset = slot * slot_size
+        for offset, length, _ in batch:
+            start = slot_offset + offset
+            yield bytes(output_shm.buf[start:start + length])
+        return slot
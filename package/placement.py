@@ -0,0 +1,114 @@
+from collections.abc import Mapping
+
+
+class PlacementIndex:
+    '''
+    Which subfiles each user caches, as sets of subfile IDs (positions in the session indices).
+    Built in a single pass over the indices: subfile ind is cached by every user of ind.
+    '''
+
+    def __init__(self, indices, nb_receivers):
+        '''
+        :param indices:         (list) the subfile indices, as given by MulticastSession.get_chunks_indices
+        :param nb_receivers:    (int) the number of users, with IDs from 1 to nb_receivers
+        '''
+        self.indices = indices
+        self.subfile_ids = {ind: i for i, ind in enumerate(indices)}
+        self.user_subfiles = {user: set() for user in range(1, nb_receivers + 1)}
+        for i, ind in enumerate(indices):
+            for user in ind:
+                self.user_subfiles[user].add(i)
+
+    @classmethod
+    def from_user_subfiles(cls, indices, user_subfiles):
+        '''
+        :param user_subfiles:   (dict) user --> set of the IDs of the subfiles it caches, e.g. from a placement artifact
+
+        :return:    (PlacementIndex) the index, without going through the indices again
+        '''
+        placement = cls.__new__(cls)
+        placement.indices = indices
+        placement.subfile_ids = {ind: i for i, ind in enumerate(indices)}
+        placement.user_subfiles = user_subfiles
+        return placement
+
+    def is_cached(self, user, ind):
+        return self.subfile_ids.get(ind) in self.user_subfiles[user]
+
+    def get_user_indices(self, user):
+        '''
+        :return:    (list) the indices of the subfiles cached by the user, in session order
+        '''
+        return [self.indices[i] for i in sorted(self.user_subfiles[user])]
+
+
+class FileCacheView(Mapping):
+    '''
+    The subfiles of a file cached by a user: subfile index --> chunk view, read from the chunks of the file without copying them.
+    '''
+
+    def __init__(self, chunks, placement, user):
+        self.chunks = chunks
+        self.placement = placement
+        self.user = user
+
+    def __getitem__(self, ind):
+        if not self.placement.is_cached(self.user, ind):
+            raise KeyError(ind)
+        return self.chunks[ind]
+
+    def __iter__(self):
+        return (ind for ind in self.placement.get_user_indices(self.user) if ind in self.chunks)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class UserCacheView(Mapping):
+    '''
+    The cache of a user: file ID (position in the library, from 1) --> FileCacheView.
+    '''
+
+    def __init__(self, files, file_chunks, placement, user):
+        self.files = files
+        self.file_chunks = file_chunks
+        self.placement = placement
+        self.user = user
+
+    def __getitem__(self, file_id):
+        if not isinstance(file_id, int) or not 1 <= file_id <= len(self.files) or self.files[file_id - 1]["id"] not in self.file_chunks:
+            raise KeyError(file_id)
+        return FileCacheView(self.file_chunks[self.files[file_id - 1]["id"]], self.placement, self.user)
+
+    def __iter__(self):
+        return (i + 1 for i, f in enumerate(self.files) if f["id"] in self.file_chunks)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class UsersCacheView(Mapping):
+    '''
+    The caches of all the users: user ID --> UserCacheView. Nothing is materialized, the views are created on access.
+    '''
+
+    def __init__(self, files, file_chunks, placement):
+        '''
+        :param files:       (list) the library
+        :param file_chunks: (dict) library file ID --> {subfile index: chunk}, e.g. ChunkStore.get_file_chunks()
+        :param placement:   (PlacementIndex) the placement of the session
+        '''
+        self.files = files
+        self.file_chunks = file_chunks
+        self.placement = placement
+
+    def __getitem__(self, user):
+        if user not in self.placement.user_subfiles:
+            raise KeyError(user)
+        return UserCacheView(self.files, self.file_chunks, self.placement, user)
+
+    def __iter__(self):
+        return iter(self.placement.user_subfiles)
+
+    def __len__(self):
+        return len(self.placement.user_subfiles)
@@ -0,0 +1,222 @@
+'''
+Placement artifacts, prepared offline so that the server starts without recomputing the placement.
+
+An artifact is binary (version 1, network byte order, the arrays in little-endian order):
+
+    header      magic "LCPLACE" (7s), version (B), digest of the library (32s), number of receivers (H),
+                cache capacity (d), user group size (H), number of files (H), number of subfiles (I)
+    index       per run of subfile indices of the same length (one run per memory-sharing layer): length of the indices (H),
+                number of indices (I), then the indices (number * length * H)
+    boundaries  per file of the library: the number of subfiles + 1 offsets delimiting its chunks (Q),
+                see MulticastSession.get_subfile_boundaries
+    users       per user: number of cached subfiles (I), then their subfile IDs, positions in the index (I)
+
+The digest covers the path, size and modification time of every file of the library: an artifact is only used for the
+library and the session parameters it was prepared for, and prepared again otherwise.
+'''
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from itertools import groupby
+from package.placement import PlacementIndex
+from common.utils import custom_logger
+from common.config import VIDEO_PATH
+
+ARTIFACT_MAGIC = b"LCPLACE"
+ARTIFACT_VERSION = 1
+ARTIFACT_HEADER = struct.Struct("!7sB32sHdHHI")
+RUN_HEAD = struct.Struct("!HI")
+COUNT = struct.Struct("!I")
+
+
+def get_library_digest(files, video_path=VIDEO_PATH):
+    '''
+    :return:    (bytes) the SHA-256 digest of the library, over the ID, path, size and modification time of each file
+    '''
+    digest = hashlib.sha256()
+    for f in files:
+        try:
+            stat = os.stat(os.path.join(video_path, f["compressed_path"]))
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            size, mtime = -1, -1
+        digest.update(f"{f['id']}\0{f['compressed_path']}\0{size}\0{mtime}\n".encode('utf-8'))
+    return digest.digest()
+
+
+def _to_bytes(values, typecode):
+    values = array(typecode, values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(data, typecode):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class PlacementArtifact:
+    '''
+    The placement of a session: the subfile indices, the chunk boundaries of each file and the subfiles cached by each user.
+    '''
+
+    def __init__(self, digest, nb_receivers, cache_capacity, group_size, indices, boundaries, user_subfiles):
+        '''
+        :param digest:          (bytes) the digest of the library, see get_library_digest
+        :param group_size:      (int) the user group size of the session
+        :param indices:         (list) the subfile indices, as given by MulticastSession.get_chunks_indices
+        :param boundaries:      (list) per file of the library, in library order, the chunk boundaries of the file
+        :param user_subfiles:   (list) per user, from user 1, the sorted IDs of the subfiles it caches
+        '''
+        self.digest = digest
+        self.nb_receivers = nb_receivers
+        self.cache_capacity = cache_capacity
+        self.group_size = group_size
+        self.indices = indices
+        self.boundaries = boundaries
+        self.user_subfiles = user_subfiles
+
+    @classmethod
+    def prepare(cls, session, video_path=VIDEO_PATH):
+        '''
+        :param session: (MulticastSession) the session to prepare the placement of
+
+        :return:    (PlacementArtifact) the placement of the session, for the library as it is on disk
+        '''
+        indices = session.get_chunks_indices()
+        placement = PlacementIndex(indices, session.nb_receivers)
+        boundaries = []
+        for f in session.get_library():
+            try:
+                size = os.path.getsize(os.path.join(video_path, f["compressed_path"]))
+            except OSError:
+                size = 0  # Not mapped by the chunk store either
+            boundaries.append(session.get_subfile_boundaries(size))
+        user_subfiles = [sorted(placement.user_subfiles[user]) for user in range(1, session.nb_receivers + 1)]
+        return cls(get_library_digest(session.get_library(), video_path), session.nb_receivers, session.cache_capacity,
+                   session.group_size, indices, boundaries, user_subfiles)
+
+    def matches(self, session, digest):
+        '''
+        :return:    (bool) True if the artifact was prepared for the parameters of the session and the library of the given digest
+        '''
+        return (self.digest == digest and self.nb_receivers == session.nb_receivers and self.cache_capacity == session.cache_capacity
+                and self.group_size == session.group_size and len(self.boundaries) == session.nb_items)
+
+    def get_placement_index(self):
+        return PlacementIndex.from_user_subfiles(self.indices, {user + 1: set(subfiles) for user, subfiles in enumerate(self.user_subfiles)})
+
+    def get_boundaries(self, files):
+        '''
+        :return:    (dict) file ID --> chunk boundaries, for ChunkStore
+        '''
+        return {f["id"]: boundaries for f, boundaries in zip(files, self.boundaries)}
+
+    def write(self, path):
+        '''
+        Writes the artifact to a temporary file, then moves it to the path, so that a server never reads a partial artifact.
+        '''
+        parts = [ARTIFACT_HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION, self.digest, self.nb_receivers, self.cache_capacity,
+                                      self.group_size, len(self.boundaries), len(self.indices))]
+        for t, run in groupby(self.indices, len):
+            run = list(run)
+            parts.append(RUN_HEAD.pack(t, len(run)) + _to_bytes((user for ind in run for user in ind), 'H'))
+        for boundaries in self.boundaries:
+            parts.append(_to_bytes(boundaries, 'Q'))
+        for subfiles in self.user_subfiles:
+            parts.append(COUNT.pack(len(subfiles)) + _to_bytes(subfiles, 'I'))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(b"".join(parts))
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def read(cls, path):
+        '''
+        :return:    (PlacementArtifact) the artifact of the file
+
+        :raises ValueError: if the file is not an artifact of this version
+        '''
+        with open(path, 'rb') as file:
+            data = memoryview(file.read())
+        magic, version, digest, nb_receivers, cache_capacity, group_size, nb_files, nb_subfiles = ARTIFACT_HEADER.unpack_from(data)
+        if magic != ARTIFACT_MAGIC or version != ARTIFACT_VERSION:
+            raise ValueError(f"{path} is not a placement artifact of version {ARTIFACT_VERSION}")
+        position = ARTIFACT_HEADER.size
+        indices = []
+        while len(indices) < nb_subfiles:
+            t, count = RUN_HEAD.unpack_from(data, position)
+            position += RUN_HEAD.size
+            if count == 0:
+                raise ValueError(f"{path} has an empty run of subfile indices")
+            users = _from_bytes(data[position:position + 2 * t * count], 'H')
+            indices += zip(*[iter(users)] * t) if t else [()] * count
+            position += 2 * t * count
+        boundaries = []
+        size = 8 * (nb_subfiles + 1)
+        for _ in range(nb_files):
+            boundaries.append(_from_bytes(data[position:position + size], 'Q'))
+            position += size
+        user_subfiles = []
+        for _ in range(nb_receivers):
+            count, = COUNT.unpack_from(data, position)
+            position += COUNT.size
+            user_subfiles.append(_from_bytes(data[position:position + 4 * count], 'I'))
+            position += 4 * count
+        if position != len(data):
+            raise ValueError(f"{path} is truncated or has trailing data")
+        return cls(digest, nb_receivers, cache_capacity, group_size, indices, boundaries, user_subfiles)
+
+
+def prepare_placement_artifact(path, session, video_path=VIDEO_PATH):
+    '''
+    Prepares the placement of the session and writes it to the path.
+
+    :return:    (PlacementArtifact) the artifact
+    '''
+    artifact = PlacementArtifact.prepare(session, video_path)
+    artifact.write(path)
+    custom_logger(f"Placement of {len(artifact.indices)} subfiles per file prepared in {path}")
+    return artifact
+
+
+def load_placement_artifact(path, session, video_path=VIDEO_PATH):
+    '''
+    Reads the artifact of the path if it was prepared for the session and the current library, prepares it again otherwise.
+    Without a path, the placement is prepared in memory only. The artifact only speeds up the next start: when it cannot be
+    written, the placement prepared in memory is used.
+
+    :return:    (PlacementArtifact) the artifact
+    '''
+    if not path:
+        return PlacementArtifact.prepare(session, video_path)
+    if os.path.exists(path):
+        try:
+            artifact = PlacementArtifact.read(path)
+            if artifact.matches(session, get_library_digest(session.get_library(), video_path)):
+                session.check_parameters()
+                return artifact
+            custom_logger(f"Placement artifact {path} is stale (library or parameters changed), preparing it again", level="warning")
+        except (OSError, ValueError, struct.error) as e:
+            custom_logger(f"Unable to read the placement artifact {path}: {e}", level="warning")
+    artifact = PlacementArtifact.prepare(session, video_path)
+    try:
+        artifact.write(path)
+        custom_logger(f"Placement of {len(artifact.indices)} subfiles per file prepared in {path}")
+    except OSError as e:
+        custom_logger(f"Unable to write the placement artifact {path}, using the placement prepared in memory: {e}", level="warning")
+    return artifact
@@ -0,0 +1,108 @@
+'''
+Framing of the unicast placement phase, where each receiver gets its cache before the multicast transmission.
+
+The receiver opens the connection with a request frame and the server answers with a sequence of frames.
+Every frame is a header (network byte order): type (B), payload length (I), followed by the payload:
+
+    REQUEST     {"receiver": ID, "file": requested file ID} as UTF-8 JSON, preceded on the wire by PLACEMENT_MAGIC
+    ADDRESSES   the multicast addresses to join, as a UTF-8 JSON list
+    MANIFEST    the number of subfiles (I), then per subfile: file ID (H), length t of the subfile index (B),
+                subfile index (t * H), length of the subfile (I)
+    SUBFILE     the position of the subfile in the manifest (I), then the raw subfile
+    END         empty, the cache is complete
+
+Payloads are never scanned for sentinels, so any byte sequence can be sent, and the frames do not depend on how TCP
+splits or coalesces the stream.
+'''
+import json
+import struct
+
+PLACEMENT_MAGIC = b"LCPL"
+
+REQUEST = 1
+ADDRESSES = 2
+MANIFEST = 3
+SUBFILE = 4
+END = 5
+
+FRAME_HEADER = struct.Struct("!BI")
+COUNT = struct.Struct("!I")
+ENTRY_HEAD = struct.Struct("!HB")
+ENTRY_LENGTH = struct.Struct("!I")
+SUBFILE_HEAD = struct.Struct("!I")
+
+
+class PlacementProtocolError(ValueError):
+    pass
+
+
+def frame_header(frame_type, length):
+    return FRAME_HEADER.pack(frame_type, length)
+
+
+def encode_request(receiver_id, file_id):
+    payload = json.dumps({"receiver": receiver_id, "file": file_id}).encode('utf-8')
+    return PLACEMENT_MAGIC + frame_header(REQUEST, len(payload)) + payload
+
+
+def encode_addresses(addresses):
+    payload = json.dumps(addresses).encode('utf-8')
+    return frame_header(ADDRESSES, len(payload)) + payload
+
+
+def encode_manifest(entries):
+    '''
+    :param entries: (list) tuples (file ID, subfile index, length), in the order of the SUBFILE frames
+    '''
+    payload = bytearray(COUNT.pack(len(entries)))
+    for file_id, subfile, length in entries:
+        payload += ENTRY_HEAD.pack(int(file_id), len(subfile)) + struct.pack(f"!{len(subfile)}H", *subfile) + ENTRY_LENGTH.pack(length)
+    return frame_header(MANIFEST, len(payload)) + payload
+
+
+def get_subfile_buffers(position, subfile):
+    '''
+    :return:    (list) the buffers of a SUBFILE frame, the subfile itself is not copied
+    '''
+    return [frame_header(SUBFILE, SUBFILE_HEAD.size + len(subfile)) + SUBFILE_HEAD.pack(position), subfile]
+
+
+def encode_end():
+    return frame_header(END, 0)
+
+
+def parse_manifest(payload):
+    '''
+    :return:    (list) tuples (file ID, subfile index, length)
+    '''
+    view = memoryview(payload)
+    nb_entries, = COUNT.unpack_from(view)
+    entries = []
+    position = COUNT.size
+    for _ in range(nb_entries):
+        file_id, t = ENTRY_HEAD.unpack_from(view, position)
+        position += ENTRY_HEAD.size
+        subfile = struct.unpack_from(f"!{t}H", view, position)
+        position += 2 * t
+        length, = ENTRY_LENGTH.unpack_from(view, position)
+        position += ENTRY_LENGTH.size
+        entries.append((file_id, subfile, length))
+    return entries
+
+
+def recv_exactly(stream, size):
+    '''
+    :param stream:  (file) a binary file object over the socket (socket.makefile('rb'))
+    '''
+    data = stream.read(size)
+    if len(data) < size:
+        raise PlacementProtocolError("Connection closed in the middle of a frame")
+    return data
+
+
+def read_frame(stream):
+    '''
+    :return:    (tuple) (frame type, payload)
+    '''
+    frame_type, length = FRAME_HEADER.unpack(recv_exactly(stream, FRAME_HEADER.size))
+    return frame_type, recv_exactly(stream, length)
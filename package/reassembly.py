@@ -0,0 +1,133 @@
+import time
+from collections import defaultdict
+from package import fec
+from package.wire_format import PARITY, WireFormatError, get_packet_type, parse_parity_payload
+
+
+class PendingPacket:
+    def __init__(self, header):
+        self.body = bytearray(header.body_length)
+        self.bitmap = bytearray((header.fragment_count + 7) // 8)
+        self.nb_received = 0
+        self.fragment_count = header.fragment_count
+        self.parities = defaultdict(dict)  # block --> {parity index in the block: parity fragment}
+        self.fec = None  # (block size, parity fragments per block, fragment stride), known from the first parity fragment
+
+    def has_fragment(self, index):
+        return self.bitmap[index // 8] & (1 << (index % 8))
+
+    def set_fragment(self, index, offset, payload):
+        self.bitmap[index // 8] |= 1 << (index % 8)
+        self.body[offset:offset + len(payload)] = payload
+        self.nb_received += 1
+
+
+class ReassemblyTable:
+    '''
+    Rebuilds packets from their fragments (see package.wire_format), whatever the order in which they arrive.
+    Each packet in progress has a preallocated body buffer and a bitmap of the fragments received so far,
+    duplicated fragments are ignored. Missing data fragments are recovered from the PARITY fragments when the
+    sender uses forward error correction.
+    '''
+
+    def __init__(self):
+        self.pending = {}  # (type, packet ID) --> PendingPacket
+        self.completed = set()  # (type, packet ID) of the packets already delivered
+        self.nb_duplicates = 0
+        self.nb_recovered = 0  # Data fragments recovered by the FEC
+        self.fec_decode_time = 0
+
+    def add(self, header, payload):
+        '''
+        Stores a fragment.
+
+        :param header:  (Header) the parsed header of the datagram
+        :param payload: (bytes-like) the fragment payload
+
+        :return:    (bytearray) the body of the packet if this fragment completed it, None otherwise
+        '''
+        key = (get_packet_type(header), header.packet_id)
+        if key in self.completed:
+            if header.type != PARITY:
+                self.nb_duplicates += 1
+            return None
+
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = PendingPacket(header)
+            self.pending[key] = entry
+        if header.fragment_count != entry.fragment_count or header.body_length != len(entry.body):
+            raise ValueError(f"Inconsistent fragment {header.fragment_index} of packet {header.packet_id}")
+
+        if header.type == PARITY:
+            block_size, nb_parity, parity = parse_parity_payload(payload)
+            if not block_size or not nb_parity:
+                raise WireFormatError(f"Parity fragment {header.fragment_index} of packet {header.packet_id} has an empty FEC block")
+            if entry.fec and entry.fec[:2] != (block_size, nb_parity):
+                raise WireFormatError(f"Inconsistent FEC parameters in packet {header.packet_id}")
+            block, index = divmod(header.fragment_index, nb_parity)
+            if block * block_size >= entry.fragment_count:
+                raise WireFormatError(f"Parity fragment {header.fragment_index} of packet {header.packet_id} outside its blocks")
+            if index in entry.parities[block]:
+                self.nb_duplicates += 1
+                return None
+            entry.fec = (block_size, nb_parity, len(parity))
+            entry.parities[block][index] = bytes(parity)  # The payload may be a view of a reused receive buffer
+        else:
+            end = header.fragment_offset + len(payload)
+            if header.fragment_index >= entry.fragment_count or end > len(entry.body):
+                raise ValueError(f"Inconsistent fragment {header.fragment_index} of packet {header.packet_id}")
+            if entry.has_fragment(header.fragment_index):
+                self.nb_duplicates += 1
+                return None
+            entry.set_fragment(header.fragment_index, header.fragment_offset, payload)
+            block = header.fragment_index // entry.fec[0] if entry.fec else None
+
+        if entry.fec and entry.nb_received < entry.fragment_count:
+            self.recover_block(entry, block)
+        if entry.nb_received < entry.fragment_count:
+            return None
+        del self.pending[key]
+        self.completed.add(key)
+        return entry.body
+
+    def recover_block(self, entry, block):
+        '''
+        Rebuilds the missing data fragments of a block as soon as enough data and parity fragments were received.
+        '''
+        block_size, nb_parity, stride = entry.fec
+        start = block * block_size
+        end = min(start + block_size, entry.fragment_count)
+        received = [i for i in range(start, end) if entry.has_fragment(i)]
+        if len(received) == end - start or len(received) + len(entry.parities[block]) < end - start:
+            return
+
+        begin = time.perf_counter()
+        body = memoryview(entry.body)
+        fragments = {i - start: body[i * stride:(i + 1) * stride] for i in received}
+        recovered = fec.recover(end - start, nb_parity, fragments, entry.parities[block])
+        for position, fragment in recovered.items():
+            offset = (start + position) * stride
+            entry.set_fragment(start + position, offset, fragment[:len(entry.body) - offset])
+        del entry.parities[block]
+        self.nb_recovered += len(recovered)
+        self.fec_decode_time += time.perf_counter() - begin
+
+    def get_missing_fragments(self, packet_type):
+        '''
+        :return:    (dict) packet ID --> list of the missing fragment indices, for the incomplete packets of the given type
+        '''
+        missing = {}
+        for (entry_type, packet_id), entry in self.pending.items():
+            if entry_type == packet_type:
+                missing[packet_id] = [i for i in range(entry.fragment_count) if not entry.has_fragment(i)]
+        return missing
+
+    def get_incomplete_packets(self, packet_type, nb_packets):
+        '''
+        :param packet_type: (int) the type of the packets
+        :param nb_packets:  (int) the number of packets that were sent, with IDs from 0 to nb_packets - 1
+
+        :return:    (list) the sorted IDs of the packets that are not complete, received partially or not at all
+        '''
+        return [packet_id for packet_id in range(nb_packets) if (packet_type, packet_id) not in self.completed]
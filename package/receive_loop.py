@@ -0,0 +1,102 @@
+import selectors
+import time
+from package.reassembly import ReassemblyTable
+from common.utils import custom_logger
+
+BUFFER_SIZE = 65535  # Largest UDP datagram
+POLL_TIMEOUT = 5  # Seconds between two warnings while no group receives anything
+IDLE_TIMEOUT = 120  # Seconds without any datagram before giving up on the groups still open
+MAX_DRAIN = 256  # Datagrams read from a ready socket before serving the other groups
+
+
+class GroupReceiver:
+    '''
+    Reception state of a joined multicast group.
+    '''
+
+    def __init__(self, multicast_group, sock, index=0):
+        '''
+        :param multicast_group: (tuple) the (address, port) of the group
+        :param sock:            (socket) the socket bound to the group
+        :param index:           (int) the position of the group in the multicast addresses of the server
+        '''
+        self.multicast_group = multicast_group
+        self.sock = sock
+        self.index = index
+        self.table = ReassemblyTable()
+        self.binary_packets = {}  # packet ID --> (descriptors, payload), completed before the session descriptor
+        self.json_chunks = []  # Datagrams of the JSON packet being received
+        self.received_packets = []  # Decoded JSON packets
+        self.session_descriptor = None
+        self.plan = None  # DecodingPlan of the requested file, built from the session descriptor
+        self.decoder = None  # StreamingDecoder of the receiver, shared by all the groups, set with the session descriptor
+        self.nb_packets = 0
+        self.binary = False  # Whether the group uses the binary wire format, which has a repair round
+        self.done = False
+
+
+class ReceiveLoop:
+    '''
+    Readiness-based receive loop serving all the joined groups at once: the sockets are non-blocking and registered in a
+    selector, so an idle group never delays the others. A ready socket is drained (up to MAX_DRAIN datagrams) into a single
+    reusable buffer, and each datagram is handed to the handler as a memoryview of that buffer, valid until the handler returns.
+    '''
+
+    def __init__(self, groups, handler, on_complete=None, idle_timeout=IDLE_TIMEOUT):
+        '''
+        :param groups:          (list) the GroupReceiver of each joined group
+        :param handler:         (function) handler(group, datagram), returns True when the datagram completes the group
+        :param on_complete:     (function) on_complete(group), called once a group is complete and its socket unregistered
+        :param idle_timeout:    (int) seconds without any datagram before the loop gives up
+        '''
+        self.groups = groups
+        self.handler = handler
+        self.on_complete = on_complete
+        self.idle_timeout = idle_timeout
+        self.buffer = bytearray(BUFFER_SIZE)
+        self.nb_datagrams = 0
+
+    def run(self):
+        '''
+        Receives until every group has signalled its completion, or no datagram arrived for idle_timeout seconds.
+
+        :return:    (list) the groups that did not complete
+        '''
+        selector = selectors.DefaultSelector()
+        for group in self.groups:
+            group.sock.setblocking(False)
+            selector.register(group.sock, selectors.EVENT_READ, group)
+
+        view = memoryview(self.buffer)
+        open_groups = len(self.groups)
+        last_datagram = time.monotonic()
+        try:
+            while open_groups:
+                events = selector.select(POLL_TIMEOUT)
+                if not events:
+                    idle = time.monotonic() - last_datagram
+                    if idle >= self.idle_timeout:
+                        custom_logger(f"No datagram for {idle:.0f} s, giving up on {open_groups} groups", level="error")
+                        break
+                    custom_logger(f"Waiting for {open_groups} groups...", level="warning")
+                    continue
+
+                last_datagram = time.monotonic()
+                for key, _ in events:
+                    group = key.data
+                    for _ in range(MAX_DRAIN):
+                        try:
+                            size = group.sock.recv_into(self.buffer)
+                        except BlockingIOError:
+                            break
+                        self.nb_datagrams += 1
+                        if self.handler(group, view[:size]):
+                            group.done = True
+                            selector.unregister(group.sock)
+                            open_groups -= 1
+                            if self.on_complete:
+                                self.on_complete(group)
+                            break
+        finally:
+            selector.close()
+        return [group for group in self.groups if not group.done]
@@ -1,13 +1,25 @@
 import json
 import os
+import select
 import socket
 import struct
 import subprocess
+import threading
 from package.logger_manager import LoggerManager
-from common.utils import custom_logger, xor, decode_packet, get_unicast_address
+from package.wire_format import DATA, END, REPAIR_FRAME, REPAIR_ROUNDS, SESSION, WireFormatError, encode_nack, encode_ready, get_packet_type, get_session_id, is_binary_datagram, parse_data_body, parse_datagram, parse_end_body, parse_session_body
+from package.receive_loop import GroupReceiver, ReceiveLoop
+from package.decoding_plan import DecodingPlan, get_session_from_descriptor
+from package.output_writer import OutputWriter, get_cumulative_layout
+from package.streaming_decoder import StreamingDecoder
+from package.placement_protocol import ADDRESSES, END as PLACEMENT_END, MANIFEST, SUBFILE, SUBFILE_HEAD, PlacementProtocolError, encode_request, parse_manifest, read_frame
+from common.utils import custom_logger, decode_packet, get_socket_rcvbuf, get_unicast_address
 from common.config import SIMULATION_OUTPUT_PATH, UNICAST_PORT
-BUFFER_SIZE = 1024
+BUFFER_SIZE = 65535  # Largest UDP datagram, the datagram size depends on the MTU configured on the server
 SERVER_ADDRESS = ('', 10000)
+REPAIR_TIMEOUT = 60  # Seconds to wait for the server during the repair round
+REPAIR_DRAIN_TIMEOUT = 1  # Seconds without datagram before giving up on the re-multicast packets
+REPAIR_RECV_SIZE = 65536
+READY_TIMEOUT = 10  # Seconds to wait for the server to take the READY
 
 class MulticastReceiver:
     def __init__(self, sim_id, light_id, config_file, cache=None):
@@ -15,10 +27,16 @@ class MulticastReceiver:
         self.logger_manager = LoggerManager(sim_id)
         self.light_id = light_id
         self.cache = cache
+        self.cache_index = cache.get_index() if cache else {}  # (file ID, subfile index) --> subfile
+        self.file_id = None  # The requested file, known when the reception starts
         self.list_of_xor_packets = []
         self.indices = []  # Assuming this is needed for decoding
         self.socks = []  # List of sockets for different multicast groups
+        self.session_id = get_session_id(sim_id)
+        self.repair_threads = []
+        self.decoder = None  # StreamingDecoder shared by all the groups, started with the first session descriptor
         self.unicast_server_address = (get_unicast_address(config_file), UNICAST_PORT)
+        self.socket_rcvbuf = get_socket_rcvbuf(config_file)
 
 
     def set_list_of_xor_packets(self, packets):
@@ -30,41 +48,42 @@ class MulticastReceiver:
 
     def set_cache(self, cache):
         self.cache = cache
+        self.cache_index = cache.get_index()
     
-    def send_unicast_request(self, requested_fileID):
+    def send_unicast_request(self, requested_fileID, cache):
+        '''
+        Placement phase: requests the cache of the receiver to the unicast server and writes the subfiles straight into the cache store
+        as they arrive (see package.placement_protocol). The multicast addresses to join are received first.
+
+        :param requested_fileID:    (int) the requested file
+        :param cache:               (Cache) the cache store of the receiver
+        '''
         try:
-            unicast_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            unicast_sock.connect(self.unicast_server_address)
-            request_message = f"{self.light_id},{requested_fileID}"
-            unicast_sock.sendall(request_message.encode('utf-8'))
-            
-            cache = []
-            first_packet_received = False  # Flag to track the first packet
-            
-            while True:
-                data = unicast_sock.recv(BUFFER_SIZE)
-                
-                if not first_packet_received:
-                    # Skip the first packet
-                    first_packet_received = True
-                    self.multicast_addresses = json.loads(data.decode("utf-8"))
-                    continue
-                
-                if b'LAST_PACKET' in data:
-                    parts = data.split(b'LAST_PACKET', 1)
-                    if parts[0]:
-                        cache.append(parts[0])
-                    self.logger_manager.update("logs", "Received LAST_PACKET", append=True)
-                    custom_logger("Received LAST_PACKET", level="info")
-                    break
-                
-                cache.append(data)
-            
-            unicast_sock.close()
-            
-            joined_bytes = b''.join(cache)  # Combine all byte sequences into one
-            return decode_packet(joined_bytes)  # Decode bytes to string
-        
+            with socket.create_connection(self.unicast_server_address) as unicast_sock:
+                unicast_sock.sendall(encode_request(self.light_id, requested_fileID))
+                stream = unicast_sock.makefile('rb')
+                writer = None
+                try:
+                    while True:
+                        frame_type, payload = read_frame(stream)
+                        if frame_type == ADDRESSES:
+                            self.multicast_addresses = json.loads(payload.decode("utf-8"))
+                        elif frame_type == MANIFEST:
+                            writer = cache.open_writer(parse_manifest(payload))
+                        elif frame_type == SUBFILE and writer:
+                            position, = SUBFILE_HEAD.unpack_from(payload)
+                            writer.write(position, memoryview(payload)[SUBFILE_HEAD.size:])
+                        elif frame_type == PLACEMENT_END and writer:
+                            writer.commit()
+                            break
+                        else:
+                            raise PlacementProtocolError(f"Unexpected frame type {frame_type}")
+                except Exception:
+                    if writer:
+                        writer.abort()
+                    raise
+            self.logger_manager.update("logs", "Received cache", append=True)
+            custom_logger("Received cache", level="info")
         except Exception as e:
             custom_logger(f"Unicast server seems down. Exiting: {e}", level="error")
             exit()
@@ -87,24 +106,253 @@ class MulticastReceiver:
             extracted_values.append(value)
         return extracted_values
     
-    def check_key_in_dict_items(self, dict_items, key):
-        for item in dict_items:
-            _, inner_dict = item
-            if key in inner_dict:
-                return True
+    def handle_datagram(self, group, data):
+        '''
+        Handles a datagram received on a group, in the binary or the JSON debug format.
+
+        :param group:   (GroupReceiver) the group the datagram was received on
+        :param data:    (bytes-like) the datagram, only valid during the call
+
+        :return:    True when the group has signalled the end of its transmission
+        '''
+        if is_binary_datagram(data):
+            return self.handle_binary_datagram(group, data)
+        if data == b"END_OF_CHUNK":
+            group.received_packets.append(decode_packet(b''.join(group.json_chunks)))
+            group.json_chunks = []
+        elif data == b"LAST_PACKET":
+            return True
+        else:
+            group.json_chunks.append(bytes(data))
         return False
-    
-    def save_video_file(self, file_path, data):
-        """Save the video file."""
-        with open(file_path, "wb") as file:
-            file.write(data)
-            
+
+    def handle_binary_datagram(self, group, data):
+        '''
+        Handles a datagram of the binary wire format, fragments are reassembled in the table of the group whatever their order.
+
+        :param group:   (GroupReceiver) the group the datagram was received on
+        :param data:    (bytes-like) the datagram
+
+        :return:    True when the END packet of the group has been received
+        '''
+        try:
+            header, payload = parse_datagram(data)
+            if header.session_id != self.session_id:
+                return False
+            group.binary = True
+            body = group.table.add(header, payload)
+            if body is None:
+                return False
+            # Parsed before anything is updated, so that a malformed body is dropped as a whole
+            packet_type = get_packet_type(header)
+            if packet_type == DATA:
+                parsed = parse_data_body(body)
+            elif packet_type == SESSION:
+                parsed = parse_session_body(body)
+            elif packet_type == END:
+                parsed = parse_end_body(body)
+        except (WireFormatError, ValueError) as e:
+            custom_logger(f"Dropping datagram: {e}", level="warning")
+            return False
+
+        if packet_type == DATA:
+            if self.decoder:
+                self.decoder.submit(header.packet_id, *parsed)
+            elif group.session_descriptor is None:
+                # Not decodable before the session descriptor
+                group.binary_packets[header.packet_id] = parsed
+        elif packet_type == SESSION:
+            group.session_descriptor = parsed
+            self.start_decoder(group)
+        elif packet_type == END:
+            group.nb_packets = parsed
+            self.report_fec(group.table)
+            self.report_incomplete_packets(group)
+            return True
+        return False
+
+    def get_decoding_plan(self, session_descriptor):
+        '''
+        :return:    (DecodingPlan) the decoding plan of the requested file, None if the descriptor does not carry the session parameters
+        '''
+        try:
+            return DecodingPlan.from_session_descriptor(session_descriptor, self.cache_index, self.file_id)
+        except (KeyError, TypeError, ValueError) as e:
+            custom_logger(f"No decoding plan from the session descriptor: {e}", level="warning")
+            return None
+
+    def get_output_path(self, file_id):
+        return os.path.join(SIMULATION_OUTPUT_PATH, f"{self.sim_id}-server{self.light_id}-video_{file_id}.mp4")
+
+    def start_decoder(self, group):
+        '''
+        Starts the streaming decoder of the receiver with the first session descriptor, the groups all carry the same session
+        and share the decoder and the output file. The packets completed on the group before are handed to it.
+        '''
+        if self.decoder is None:
+            plan = self.get_decoding_plan(group.session_descriptor)
+            if plan is None:
+                return
+            indices = [tuple(ind) for ind in group.session_descriptor["indices"]]
+            try:
+                file_size = group.session_descriptor["file_sizes"][self.file_id - 1]
+                layout = get_session_from_descriptor(group.session_descriptor).get_subfile_layout(file_size, indices)
+                writer = OutputWriter(self.get_output_path(self.file_id), layout)
+            except (KeyError, IndexError, OSError) as e:
+                custom_logger(f"Unable to prepare the output file: {e}", level="error")
+                return
+
+            def on_progress(nb_decoded, nb_subfiles):
+                message = f"Receiver {self.light_id}: decoded {nb_decoded}/{nb_subfiles} subfiles"
+                self.logger_manager.update("logs", message, append=True)
+                custom_logger(message, level="info")
+
+            self.decoder = StreamingDecoder(plan, self.cache_index, self.file_id, indices, writer, on_progress)
+            self.decoder.start()
+        group.plan, group.decoder = self.decoder.plan, self.decoder
+        for packet_id, (descriptors, payload) in sorted(group.binary_packets.items()):
+            self.decoder.submit(packet_id, descriptors, payload)
+        group.binary_packets = {}
+
+    def get_missing_packets(self, group):
+        '''
+        :return:    (list) the IDs of the DATA packets still missing on the group: when the packets are striped across the groups,
+                    only those sent on the group, when they are mirrored, only those received on no group
+        '''
+        missing = group.table.get_incomplete_packets(DATA, group.nb_packets)
+        descriptor = group.session_descriptor or {}
+        if descriptor.get("group_mode") == "stripe":
+            return [packet_id for packet_id in missing if packet_id % descriptor["nb_groups"] == group.index]
+        if self.decoder:
+            return [packet_id for packet_id in missing if packet_id not in self.decoder.received]
+        return missing
+
+    def start_repair(self, group):
+        '''
+        Called by the receive loop when a group completes: the repair round of a binary transmission runs on its own thread,
+        so the loop keeps serving the other groups.
+        '''
+        if group.binary:
+            thread = threading.Thread(target=self.request_repair, args=(group,))
+            thread.start()
+            self.repair_threads.append(thread)
+
+    def request_repair(self, group):
+        '''
+        Repair rounds of a group: a new round follows each round in which something was missing, up to REPAIR_ROUNDS rounds.
+        '''
+        missing = self.get_missing_packets(group)
+        for repair_round in range(REPAIR_ROUNDS):
+            try:
+                if not self.repair_round(group, repair_round):
+                    break
+            except OSError as e:
+                custom_logger(f"Repair failed: {e}", level="error")
+                return
+        if not missing:
+            return
+
+        still_missing = self.get_missing_packets(group)
+        message = f"Receiver {self.light_id}: repaired {len(missing) - len(still_missing)}/{len(missing)} packets on {group.multicast_group}"
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="info" if not still_missing else "warning")
+
+    def repair_round(self, group, repair_round):
+        '''
+        Repair round of a group: reports what is missing to the server over the unicast channel (an empty NACK when nothing is
+        missing): the DATA packets not received at all, the missing fragments of the packets received partially, and the SESSION
+        packet if no descriptor was received. Then gets the repaired fragments, in unicast on the same connection and re-multicast
+        on the group. Both sockets are read together, so the re-multicast datagrams do not pile up in the socket buffer during
+        the unicast repairs.
+
+        :param repair_round:    (int) the round, from 0, sent with the NACK
+
+        :return:    (bool) True if the NACK was not empty, the server then expects a NACK in the next round
+        '''
+        sock = group.sock
+        missing = self.get_missing_packets(group)
+        partial = group.table.get_missing_fragments(DATA)
+        fragments = {packet_id: partial[packet_id] for packet_id in missing if packet_id in partial}
+        packets = [packet_id for packet_id in missing if packet_id not in fragments]
+        session = group.session_descriptor is None
+        with socket.create_connection(self.unicast_server_address, timeout=REPAIR_TIMEOUT) as unicast_sock:
+            unicast_sock.sendall(encode_nack(self.light_id, group.multicast_group, repair_round, packets, fragments, session))
+            stream = bytearray()
+            unicast_done = False
+            while not unicast_done or group.session_descriptor is None or self.get_missing_packets(group):
+                sockets = [sock] if unicast_done else [sock, unicast_sock]
+                readable, _, _ = select.select(sockets, [], [], REPAIR_DRAIN_TIMEOUT if unicast_done else REPAIR_TIMEOUT)
+                if not readable:
+                    break
+                if sock in readable:
+                    try:
+                        data, _ = sock.recvfrom(BUFFER_SIZE)
+                    except BlockingIOError:
+                        data = b""
+                    if is_binary_datagram(data):
+                        self.handle_binary_datagram(group, data)
+                if unicast_sock in readable:
+                    data = unicast_sock.recv(REPAIR_RECV_SIZE)
+                    if not data:
+                        raise ConnectionError("Repair round interrupted")
+                    stream += data
+                    # Length-prefixed frames, a zero length ends the unicast repairs
+                    while len(stream) >= REPAIR_FRAME.size and not unicast_done:
+                        length, = REPAIR_FRAME.unpack_from(stream)
+                        if not length:
+                            unicast_done = True
+                        elif len(stream) < REPAIR_FRAME.size + length:
+                            break
+                        else:
+                            self.handle_binary_datagram(group, bytes(stream[REPAIR_FRAME.size:REPAIR_FRAME.size + length]))
+                        del stream[:REPAIR_FRAME.size + length]
+        return bool(missing or session)
+
+    def report_fec(self, table):
+        if not table.nb_recovered:
+            return
+        message = f"Receiver {self.light_id}: FEC recovered {table.nb_recovered} fragments, decode time {table.fec_decode_time:.3f} s"
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="info")
+
+    def report_incomplete_packets(self, group):
+        incomplete = self.get_missing_packets(group)
+        if not incomplete:
+            return
+        missing_fragments = group.table.get_missing_fragments(DATA)
+        details = ", ".join(f"{packet_id} ({len(missing_fragments[packet_id])} fragments missing)" if packet_id in missing_fragments else f"{packet_id} (not received)"
+                            for packet_id in incomplete)
+        message = f"Receiver {self.light_id}: {len(incomplete)}/{group.nb_packets} incomplete packets on {group.multicast_group}: {details}"
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="warning")
+
+    def iter_decoded_subfiles(self, packets, plan):
+        '''
+        :param packets: (dict) packet ID --> (coded payload, {(file ID, subfile index): length}), the packets are removed once decoded
+        :param plan:    (DecodingPlan) the decoding plan of the requested file
+
+        :return:    (generator) tuples (subfile index, decoded subfile)
+        '''
+        for packet_id in sorted(packets):
+            payload, lengths = packets.pop(packet_id)
+            if packet_id not in plan:
+                continue
+            target = plan.steps[packet_id][0]
+            try:
+                target, value = plan.decode(packet_id, payload, lengths.get(target), self.cache_index)
+            except KeyError as e:
+                custom_logger(f"Unable to decode packet {packet_id}, missing cached subfile {e}", level="error")
+                continue
+            yield target[1], value
+
     def join_multicast_group(self, multicast_group, index: int):
         port = 10000 + index
         print(f"{multicast_group}:{port}")
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if self.socket_rcvbuf > 0:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_rcvbuf)
         
         # Bind to the interface address, not the multicast address
         sock.bind(('', port))  # Bind to all interfaces on the given port
@@ -113,6 +361,7 @@ class MulticastReceiver:
         mreq = struct.pack('4sL', group, socket.INADDR_ANY)
         sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
         self.socks.append(sock)
+        return sock
 
     def open_video_with_vlc(self, file_path):
         """Open the video file with VLC media player."""
@@ -132,71 +381,85 @@ class MulticastReceiver:
 
 
     def start(self, file_id):
-        decoded_message = b""
-        index = 0
-        
-        for address in self.multicast_addresses:
-            self.join_multicast_group(address, index)
-            index += 1
-            received_packets = []
-            chunks = {sock: [] for sock in self.socks}
-            
-            while True:
-                for sock in list(self.socks):
-                    try:
-                        sock.settimeout(5)
-                        data, _ = sock.recvfrom(1024)
-                        
-                        if data == b"END_OF_CHUNK":
-                            received_packets.append(decode_packet(b''.join(chunks[sock])))
-                            chunks[sock] = []
-                        elif data == b"LAST_PACKET":
-                            self.socks.remove(sock)
-                            sock.close() 
-                            break
-                        else:
-                            chunks[sock].append(data)
-                    
-                    except socket.timeout:
-                        custom_logger(f"Timeout on socket {sock}, continuing...", level="warning")
-                        continue
-                
-                if not self.socks:
+        self.file_id = file_id
+        groups = []
+        for index, address in enumerate(self.multicast_addresses):
+            sock = self.join_multicast_group(address, index)
+            groups.append(GroupReceiver((address, 10000 + index), sock, index))
+        self.send_ready(groups)
+
+        receive_loop = ReceiveLoop(groups, self.handle_datagram, on_complete=self.start_repair)
+        for group in receive_loop.run():
+            custom_logger(f"Transmission on {group.multicast_group} did not complete", level="error")
+        for thread in self.repair_threads:
+            thread.join()
+        for sock in self.socks:
+            sock.close()
+        self.socks = []
+
+        if self.decoder:
+            # The packets of all the groups were decoded and written while they arrived
+            self.save_file(self.decoder.writer, self.decoder.finish(), file_id)
+        else:
+            # The JSON debug groups each carry the whole transmission, the first one decoded is enough
+            for group in groups:
+                if self.decode_group(group, file_id):
                     break
 
-            list_of_xor_packets = self.get_list_of_xor_packets(received_packets)
-            transmitted_packets = self.get_list_of_transmitted_packets(received_packets)
-            
-            indices = received_packets[0]["all_indices"]
-            decoded_chunks = {}
-            current_fileID = None
-            current_chunkID = None
-            
-            for i, xor_packet in enumerate(list_of_xor_packets):
-                packet = transmitted_packets[i]
-                for fc in xor_packet:
-                    fileID = fc[0]
-                    chunkID = fc[1]
-                    if self.check_key_in_dict_items(self.get_cache().items(), chunkID):
-                        packet = xor(packet, self.get_cache()[fileID][chunkID])
-                    else:
-                        current_fileID = fileID
-                        current_chunkID = chunkID
-                if current_fileID == file_id:
-                    decoded_chunks[current_chunkID] = packet
-
-            for ind in indices:
-                if tuple(ind) in decoded_chunks:
-                    decoded_message += decoded_chunks[tuple(ind)]
-                else:
-                    decoded_message += self.get_cache()[file_id][tuple(ind)]
-
-            file_path = os.path.join(SIMULATION_OUTPUT_PATH, f"{self.sim_id}-server{self.light_id}-video_{file_id}.mp4")
-            self.save_video_file(file_path, decoded_message)
-            video_size = os.path.getsize(file_path)
-            custom_logger(f"video size : {video_size}", level="success")
-            # logger.info(f"Successfully decoded and saved as: {file_path}. Opening with VLC...")
-            # self.open_video_with_vlc(file_path)
-
-            # Log the success message
-            custom_logger("Video file has been successfully saved.", level="finished")
+    def send_ready(self, groups):
+        '''
+        Acknowledges to the server that the receiver joined the multicast groups: the transmission starts once every receiver is ready.
+        '''
+        try:
+            with socket.create_connection(self.unicast_server_address, timeout=READY_TIMEOUT) as unicast_sock:
+                unicast_sock.sendall(encode_ready(self.light_id, [group.multicast_group for group in groups]))
+        except OSError as e:
+            custom_logger(f"Unable to send READY, the server starts without it after a timeout: {e}", level="warning")
+
+    def decode_group(self, group, file_id):
+        '''
+        Completes the requested file from the packets received on a group with the JSON debug format and saves it:
+        each useful packet is decoded with its step of the decoding plan once the transmission is over.
+
+        :return:    True if the file was saved
+        '''
+        file_path = self.get_output_path(file_id)
+        if group.binary:
+            custom_logger("No decoding plan, unable to decode the packets", level="error")
+            return False
+        elif group.received_packets:
+            # The plan is built from the indices carried by the packets,
+            # and the layout of the file from the lengths of its subfiles once they are all decoded
+            indices = [tuple(ind) for ind in group.received_packets[0]["all_indices"]]
+            list_of_xor_packets = self.get_list_of_xor_packets(group.received_packets)
+            packets = {packet_id: (packet["value"], {(int(fc[0]), fc[1]): length for fc, length in zip(xor_packet, packet["lengths"]) if fc[0] != 'na'})
+                       for packet_id, (xor_packet, packet) in enumerate(zip(list_of_xor_packets, group.received_packets))}
+            plan = DecodingPlan.from_transmissions(list_of_xor_packets, self.cache_index, file_id)
+            decoded_chunks = dict(self.iter_decoded_subfiles(packets, plan))
+            lengths = {ind: len(decoded_chunks[ind]) if ind in decoded_chunks else len(self.cache_index.get((file_id, ind), b"")) for ind in indices}
+            writer = OutputWriter(file_path, get_cumulative_layout(indices, lengths))
+            try:
+                for ind in indices:
+                    writer.write(ind, decoded_chunks[ind] if ind in decoded_chunks else self.cache_index[(file_id, ind)])
+            except (KeyError, OSError, ValueError) as e:
+                custom_logger(f"Unable to write subfile {e}", level="error")
+            return self.save_file(writer, writer.get_missing(), file_id)
+        else:
+            custom_logger("No packet received, unable to decode the file", level="error")
+            return False
+
+    def save_file(self, writer, missing_chunks, file_id):
+        file_path = self.get_output_path(file_id)
+        writer.close(delete=bool(missing_chunks))
+        if missing_chunks:
+            custom_logger(f"Unable to decode file {file_id}, missing subfiles: {missing_chunks}", level="error")
+            return False
+
+        video_size = os.path.getsize(file_path)
+        custom_logger(f"video size : {video_size}", level="success")
+        # logger.info(f"Successfully decoded and saved as: {file_path}. Opening with VLC...")
+        # self.open_video_with_vlc(file_path)
+
+        # Log the success message
+        custom_logger("Video file has been successfully saved.", level="finished")
+        return True
@@ -0,0 +1,53 @@
+import threading
+import time
+from common.utils import custom_logger
+
+PLACEMENT = "placement"  # The receivers get their caches
+READY = "ready"  # Every receiver got its cache, waiting for them to join the multicast groups
+DELIVERY = "delivery"  # The coded packets are sent
+REPAIR = "repair"  # The NACKs are answered
+DONE = "done"
+PHASES = [PLACEMENT, READY, DELIVERY, REPAIR, DONE]
+
+
+class SessionState:
+    '''
+    Phases of a session, in order: placement --> ready --> delivery --> repair --> done.
+    Each transition is timestamped, so the duration of every phase is known.
+    '''
+
+    def __init__(self, logger_manager=None):
+        self.logger_manager = logger_manager
+        self.phase = PLACEMENT
+        self.timestamps = {PLACEMENT: time.perf_counter()}
+        self.lock = threading.Lock()
+
+    def advance(self, phase):
+        '''
+        Moves the session to the given phase.
+
+        :raises ValueError: if the phase does not come after the current one
+        '''
+        with self.lock:
+            if PHASES.index(phase) <= PHASES.index(self.phase):
+                raise ValueError(f"Session cannot go from {self.phase} to {phase}")
+            self.phase = phase
+            self.timestamps[phase] = time.perf_counter()
+        custom_logger(f"Session {phase}", level="info")
+
+    def get_durations(self):
+        '''
+        :return:    (dict) phase --> seconds spent in it, for the phases already left
+        '''
+        with self.lock:
+            reached = [phase for phase in PHASES if phase in self.timestamps]
+            return {phase: self.timestamps[following] - self.timestamps[phase] for phase, following in zip(reached, reached[1:])}
+
+    def report(self):
+        durations = self.get_durations()
+        message = "Session phases: " + ", ".join(f"{phase} {duration:.3f} s" for phase, duration in durations.items())
+        custom_logger(message, level="info")
+        if self.logger_manager:
+            self.logger_manager.update("logs", message, append=True)
+            for phase, duration in durations.items():
+                self.logger_manager.update(["phases", phase], f"{duration:.3f}")
@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from common.config import SIMULATION_OUTPUT_PATH
+from package.logger_manager import get_index_path, load_simulation
+
+SIMULATION_SUFFIX = ".json"
+
+
+class SimulationIndex:
+    '''
+    Metadata of the simulations (id, status, created, nb_receivers), for listing them without reading their documents.
+    Kept in memory from the index file of the simulations (see LoggerManager.update_index): when the modification time or
+    size of the file changes, only the lines appended since the last read are applied.
+    The simulations created before the index are read once, on the first refresh.
+    The (created, ID) of the simulations are kept sorted, for all of them and per status, so that a page is a slice.
+    '''
+
+    def __init__(self):
+        self.entries = {}  # simulation ID --> metadata
+        self.order = []  # (created, simulation ID) of the simulations created by the API, oldest first
+        self.by_status = defaultdict(list)  # status --> (created, simulation ID) of its simulations, oldest first
+        self.offset = 0  # Bytes of the index file already applied
+        self.key = None  # (modification time, size) of the index file when last read
+        self.scanned = False
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.lock:
+            try:
+                stat = os.stat(get_index_path())
+                key = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                key = None
+            if key != self.key:
+                if key and key[1] < self.offset:
+                    # The index file was replaced, read it again
+                    self.entries, self.order, self.by_status = {}, [], defaultdict(list)
+                    self.offset, self.scanned = 0, False
+                if key:
+                    self.read_index()
+                self.key = key
+            if not self.scanned:
+                self.scan_simulations()
+                self.scanned = True
+
+    def read_index(self):
+        with open(get_index_path(), 'rb') as file:
+            file.seek(self.offset)
+            data = file.read()
+        end = data.rfind(b"\n") + 1  # A line still being written is applied on the next refresh
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.apply(record.pop("id"), record)
+        self.offset += end
+
+    def apply(self, sim_id, fields):
+        '''
+        Updates the metadata of a simulation and moves it in the sorted lists if its creation time or status changed.
+        Only the simulations created by the API (with a creation time) are listed, the others have no document to list.
+        '''
+        entry = self.entries.setdefault(sim_id, {})
+        before = (entry.get("created"), entry.get("status"))
+        entry.update(fields)
+        after = (entry.get("created"), entry.get("status"))
+        if before == after:
+            return
+        if before[0] is not None:
+            key = (before[0], sim_id)
+            for ids in (self.order, self.by_status[before[1]]):
+                del ids[bisect_left(ids, key)]
+        if after[0] is not None:
+            key = (after[0], sim_id)
+            insort(self.order, key)
+            insort(self.by_status[after[1]], key)
+
+    def scan_simulations(self):
+        '''
+        Adds the simulations missing from the index, from their documents.
+        '''
+        for entry in os.scandir(SIMULATION_OUTPUT_PATH):
+            sim_id = entry.name[:-len(SIMULATION_SUFFIX)]
+            if not entry.name.endswith(SIMULATION_SUFFIX) or "created" in self.entries.get(sim_id, {}):
+                continue
+            try:
+                simulation = load_simulation(sim_id)
+            except (OSError, ValueError):
+                continue
+            if "id" not in simulation:
+                continue  # Not created by the API
+            self.apply(simulation["id"], {"status": simulation.get("status"), "created": entry.stat().st_mtime,
+                                          "nb_receivers": simulation.get("nb_receivers")})
+
+    def list(self, status=None, page=1, per_page=None):
+        '''
+        :param status:      (str) only the simulations with this status, None for all
+        :param page:        (int) the page, from 1
+        :param per_page:    (int) the number of simulations per page, None for a single page of all the simulations
+
+        :return:    (tuple) (list of the simulations of the page, newest first, as {"id", "status", "created", "nb_receivers"},
+                    number of simulations with the status)
+        '''
+        self.refresh()
+        with self.lock:
+            keys = self.by_status.get(status, []) if status else self.order
+            # Newest first: the page is counted from the end of the list
+            stop = len(keys) - (page - 1) * per_page if per_page else len(keys)
+            start = max(stop - per_page, 0) if per_page else 0
+            return [{"id": sim_id, **self.entries[sim_id]} for _, sim_id in reversed(keys[start:max(stop, 0)])], len(keys)
@@ -0,0 +1,133 @@
+import queue
+import threading
+from common.utils import custom_logger
+
+PROGRESS_STEP = 10  # Percentage of the decoded subfiles between two progress logs
+
+
+class StreamingDecoder:
+    '''
+    Decode stage of a receiver, running on its own thread alongside the receive loop and fed by all the groups: each coded
+    packet is decoded with its step of the decoding plan as soon as it is complete, and the subfile is written at once in the output file.
+    Decoding then overlaps the transfer instead of following it.
+    '''
+
+    def __init__(self, plan, cache_index, file_id, indices, writer, on_progress=None):
+        '''
+        :param plan:        (DecodingPlan) the decoding plan of the requested file
+        :param cache_index: (dict) the cache of the receiver, (file ID, subfile index) --> subfile
+        :param file_id:     (int) the requested file
+        :param indices:     (list) the subfile indices of the session, subfile IDs of the packet descriptors are positions in it
+        :param writer:      (OutputWriter) the writer of the requested file
+        :param on_progress: (function) on_progress(nb decoded subfiles, nb subfiles to decode), called every PROGRESS_STEP percent
+        '''
+        self.plan = plan
+        self.cache_index = cache_index
+        self.file_id = file_id
+        self.indices = indices
+        self.writer = writer
+        self.on_progress = on_progress
+        self.packets = queue.Queue()
+        self.received = set()  # IDs of the complete packets, whatever the group they were received on
+        self.nb_decoded = 0
+        self.next_report = PROGRESS_STEP
+        # Packets of the combined steps are kept until all the packets of the steps using them have arrived
+        self.payloads = {}
+        self.missing_packets = [set(packet_ids) for _, packet_ids, _ in plan.combined_steps]  # None once decoded
+        self.nb_uses = {packet_id: len(positions) for packet_id, positions in plan.waiting.items()}
+        self.thread = threading.Thread(target=self.run)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, packet_id, descriptors, payload):
+        '''
+        Queues a complete DATA packet, packets outside of the plan and packets already received on another group are ignored.
+
+        :param descriptors: (list) the (file ID, subfile ID, length) descriptors of the packet
+        :param payload:     (bytes-like) the coded payload
+        '''
+        if packet_id in self.received:
+            return
+        self.received.add(packet_id)
+        if packet_id in self.plan:
+            self.packets.put((packet_id, descriptors, payload))
+
+    def finish(self):
+        '''
+        Waits for the queued packets to be decoded.
+
+        :return:    (list) the indices of the subfiles of the requested file that are still missing
+        '''
+        self.packets.put(None)
+        self.thread.join()
+        return self.writer.get_missing()
+
+    def run(self):
+        for ind in self.indices:
+            if (self.file_id, ind) in self.cache_index:
+                self.write(ind, self.cache_index[(self.file_id, ind)])
+
+        while True:
+            item = self.packets.get()
+            if item is None:
+                break
+            packet_id, descriptors, payload = item
+            if packet_id in self.plan.steps:
+                self.decode(packet_id, descriptors, payload)
+            if packet_id in self.plan.waiting:
+                self.decode_combined(packet_id, payload)
+
+    def decode(self, packet_id, descriptors, payload):
+        target = self.plan.steps[packet_id][0]
+        lengths = {(file, self.indices[subfile_id]): length for file, subfile_id, length in descriptors}
+        try:
+            target, value = self.plan.decode(packet_id, payload, lengths.get(target), self.cache_index)
+        except KeyError as e:
+            custom_logger(f"Unable to decode packet {packet_id}, missing cached subfile {e}", level="error")
+            return
+        if self.write(target[1], value):
+            self.report_decoded()
+
+    def decode_combined(self, packet_id, payload):
+        '''
+        Decodes the subfiles of the transmissions that were not sent once all the packets XORed to rebuild them have arrived.
+        '''
+        ready = []
+        for position in self.plan.waiting[packet_id]:
+            missing = self.missing_packets[position]
+            if missing is None or packet_id not in missing:
+                continue  # Duplicate packet
+            missing.discard(packet_id)
+            self.payloads[packet_id] = payload
+            if not missing:
+                self.missing_packets[position] = None
+                ready.append(position)
+
+        for position in ready:
+            target, packet_ids, _ = self.plan.combined_steps[position]
+            try:
+                # No packet of the step carries the length of the target, the output file knows it
+                _, value = self.plan.decode_combined(position, [self.payloads[i] for i in packet_ids], self.writer.locations[target[1]][1], self.cache_index)
+                if self.write(target[1], value):
+                    self.report_decoded()
+            except KeyError as e:
+                custom_logger(f"Unable to decode subfile {target[1]}, missing cached subfile {e}", level="error")
+            for i in packet_ids:
+                self.nb_uses[i] -= 1
+                if not self.nb_uses[i]:
+                    del self.payloads[i]
+
+    def report_decoded(self):
+        self.nb_decoded += 1
+        if self.on_progress and self.nb_decoded * 100 >= self.next_report * len(self.plan):
+            self.on_progress(self.nb_decoded, len(self.plan))
+            self.next_report = self.nb_decoded * 100 // len(self.plan) // PROGRESS_STEP * PROGRESS_STEP + PROGRESS_STEP
+
+    def write(self, index, value):
+        try:
+            self.writer.write(index, value)
+            return True
+        except (OSError, ValueError) as e:
+            custom_logger(f"Unable to write subfile {index}: {e}", level="error")
+            return False
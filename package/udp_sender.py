@@ -0,0 +1,129 @@
+import socket
+import time
+
+IP_UDP_HEADERS_SIZE = 28  # IPv4 header without options (20) + UDP header (8)
+DEFAULT_MTU = 1500
+SEND_BATCH_SIZE = 32  # Datagrams sent per token bucket acquisition
+
+
+def get_datagram_size(mtu=DEFAULT_MTU):
+    '''
+    :return:    (int) the largest UDP payload that fits in a single IP packet for the given MTU, so datagrams are never fragmented by IP
+    '''
+    return mtu - IP_UDP_HEADERS_SIZE
+
+
+class TokenBucket:
+    '''
+    Token bucket limiting both the bit rate and the packet rate, a limit of 0 disables it.
+    The bucket holds at most one batch worth of tokens, so the sender cannot burst more than a batch after an idle period.
+    '''
+
+    def __init__(self, rate_mbps=0, rate_pps=0, burst_bytes=0, burst_packets=0):
+        '''
+        :param rate_mbps:       (float) the bit rate limit, in Mbit/s
+        :param rate_pps:        (float) the packet rate limit, in datagrams/s
+        :param burst_bytes:     (int) the capacity of the byte bucket
+        :param burst_packets:   (int) the capacity of the packet bucket
+        '''
+        self.byte_rate = rate_mbps * 1e6 / 8
+        self.packet_rate = rate_pps
+        self.burst_bytes = burst_bytes
+        self.burst_packets = burst_packets
+        self.byte_tokens = burst_bytes
+        self.packet_tokens = burst_packets
+        self.last = time.perf_counter()
+
+    def is_limited(self):
+        return self.byte_rate > 0 or self.packet_rate > 0
+
+    def acquire(self, nb_bytes, nb_packets):
+        '''
+        Takes the tokens for a batch, sleeping until the bucket holds enough of them.
+        '''
+        if not self.is_limited():
+            return
+        now = time.perf_counter()
+        elapsed = now - self.last
+        self.last = now
+        self.byte_tokens = min(self.burst_bytes, self.byte_tokens + elapsed * self.byte_rate)
+        self.packet_tokens = min(self.burst_packets, self.packet_tokens + elapsed * self.packet_rate)
+
+        # The tokens may go negative: the debt is slept now and the next batch starts from an empty bucket
+        self.byte_tokens -= nb_bytes
+        self.packet_tokens -= nb_packets
+        wait = 0
+        if self.byte_rate > 0 and self.byte_tokens < 0:
+            wait = -self.byte_tokens / self.byte_rate
+        if self.packet_rate > 0 and self.packet_tokens < 0:
+            wait = max(wait, -self.packet_tokens / self.packet_rate)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class PacedSender:
+    '''
+    Sends the datagrams of a multicast group in batches, at the rate allowed by a token bucket.
+    Each datagram is given as a list of buffers (header, then payload views) that the kernel gathers with sendmsg,
+    so the payloads are never concatenated in Python.
+    '''
+
+    def __init__(self, sock, destination, rate_mbps=0, rate_pps=0, batch_size=SEND_BATCH_SIZE, sndbuf=0, mtu=DEFAULT_MTU):
+        '''
+        :param sock:        (socket) the UDP socket
+        :param destination: (tuple) the (address, port) of the group
+        :param rate_mbps:   (float) the target bit rate, in Mbit/s (0 = unlimited)
+        :param rate_pps:    (float) the target packet rate, in datagrams/s (0 = unlimited)
+        :param batch_size:  (int) the number of datagrams per batch
+        :param sndbuf:      (int) the send buffer size of the socket, in bytes (0 = system default)
+        :param mtu:         (int) the MTU of the path, the burst of the bucket is a batch of datagrams of this size
+        '''
+        self.sock = sock
+        self.destination = destination
+        self.batch_size = batch_size
+        self.batch = []
+        self.batch_bytes = 0
+        if sndbuf > 0:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        self.bucket = TokenBucket(rate_mbps, rate_pps, burst_bytes=batch_size * get_datagram_size(mtu), burst_packets=batch_size)
+        self.use_sendmsg = hasattr(sock, "sendmsg")
+        self.nb_datagrams = 0
+        self.nb_bytes = 0
+        self.send_time = 0
+
+    def send(self, buffers):
+        '''
+        Queues a datagram, the batch is sent once full.
+
+        :param buffers: (list) the bytes-like buffers of the datagram
+        '''
+        self.batch.append(buffers)
+        self.batch_bytes += sum(len(buffer) for buffer in buffers)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Sends the queued datagrams.
+        '''
+        if not self.batch:
+            return
+        begin = time.perf_counter()
+        self.bucket.acquire(self.batch_bytes, len(self.batch))
+        for buffers in self.batch:
+            if self.use_sendmsg:
+                self.nb_bytes += self.sock.sendmsg(buffers, [], 0, self.destination)
+            else:
+                self.nb_bytes += self.sock.sendto(b"".join(buffers), self.destination)
+        self.nb_datagrams += len(self.batch)
+        self.send_time += time.perf_counter() - begin
+        self.batch = []
+        self.batch_bytes = 0
+
+    def get_stats(self):
+        '''
+        :return:    (dict) the datagrams and bytes sent, the time spent sending, and the achieved packet and bit rates
+        '''
+        pps = self.nb_datagrams / self.send_time if self.send_time else 0
+        mbps = self.nb_bytes * 8 / self.send_time / 1e6 if self.send_time else 0
+        return {"datagrams": self.nb_datagrams, "bytes": self.nb_bytes, "time": self.send_time, "pps": pps, "mbps": mbps}
@@ -1,63 +1,239 @@
+import asyncio
 import json
 import socket
 import time
 import threading
 from collections import defaultdict
-from common.utils import custom_logger, get_multicast_addresses, get_unicast_address, split_into_chunks, encode_packet
+from common.utils import custom_logger, read_unicast_config
 from package.logger_manager import LoggerManager
-CHUNK_SIZE = 2048
+from package.wire_format import NACK_PREFIX, READY_PREFIX, REPAIR_FRAME, parse_nack, parse_ready
+from package.placement_protocol import PLACEMENT_MAGIC, REQUEST, FRAME_HEADER, PlacementProtocolError, encode_addresses, encode_end, encode_manifest, get_subfile_buffers
 from common.config import UNICAST_PORT
 
+
+class RepairConnection:
+    '''
+    Connection of a receiver waiting for its repairs, served by the event loop of the unicast server but written by the
+    thread of the multicast server: sendall blocks the caller until the data is handed to the transport.
+    '''
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    async def _send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def sendall(self, data):
+        asyncio.run_coroutine_threadsafe(self._send(data), self.loop).result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+    def end_round(self):
+        '''
+        Ends the repair round without any repair and closes the connection, from any thread, the event loop one included.
+        '''
+        def end():
+            self.writer.write(REPAIR_FRAME.pack(0))
+            self.writer.close()
+        self.loop.call_soon_threadsafe(end)
+
+
 class UnicastServer:
+    '''
+    Placement server: sends each receiver its cache and the multicast addresses (see package.placement_protocol),
+    then collects the NACKs of the repair rounds. All the connections are served by a single asyncio event loop,
+    at most max_clients placements at a time, each with a bounded send buffer.
+    '''
+
     def __init__(self, sim_id, users_cache, config_file, port=UNICAST_PORT):
         try:
-            self.host = get_unicast_address(config_file)
+            config = read_unicast_config(config_file)
+            self.host = config['UNICAST_IP']
             self.logger_manager = LoggerManager(sim_id)
             self.port = port
             self.users_cache = users_cache
             self.config_file = config_file
+            self.multicast_addresses = config['MULTICAST_ADDRESSES']
+            self.backlog = config['BACKLOG']
+            self.max_clients = config['MAX_CLIENTS']
+            self.send_buffer_size = config['SEND_BUFFER_SIZE']
             self.requests = defaultdict(list)
+            self.ready = set()  # The receivers that joined the multicast groups
+            self.requests_condition = threading.Condition()  # Notified on every placement and READY
+            self.placement_stats = {"receivers": 0, "bytes": 0, "first_request": None, "last_placement": None}
+            self.nacks = defaultdict(dict)  # (multicast group, repair round) --> {user ID: (Nack, RepairConnection)}
+            self.closed_rounds = defaultdict(int)  # multicast group --> number of its repair rounds already collected
+            self.repairs_closed = False  # Set at the end of the session, the NACKs are no longer collected
+            self.nacks_condition = threading.Condition()
+            self.loop = None
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(self.backlog)
         except Exception as e:
             custom_logger(e, level="critical")
             self.logger_manager.update("logs", f"ERROR: {e}", append=True)
             self.logger_manager.update("status", "error")
             exit()
-    
+
     def check_connections(self, nb):
-        return len(self.requests.keys()) >= nb
-    
+        with self.requests_condition:
+            return len(self.requests.keys()) >= nb
+
     def reset_connections(self):
-        self.requests.clear()
-        
+        with self.requests_condition:
+            self.requests.clear()
+            self.ready.clear()
+
     def get_nb_connections(self):
-        return len(self.requests.keys())
-    
-    def handle_client(self, client_socket):
-        request = client_socket.recv(1024).decode('utf-8')
-        user_id, file_id = map(int, request.split(','))
-        time.sleep(2)
-        
-        encoded_cache = encode_packet(self.users_cache[user_id])
-        cache = json.dumps(encoded_cache).encode('utf-8')
-                
-        data = split_into_chunks(cache, CHUNK_SIZE)
-        custom_logger("sending cache packets to receiver...", level="info")
-        multicast_addresses = get_multicast_addresses(self.config_file)
-        client_socket.sendall(json.dumps(multicast_addresses).encode('utf-8'))
-        for d in data:
-            client_socket.sendall(d)
-            if(d == b'LAST_PACKET'):
-                custom_logger(f"Send cache to {user_id}.", level="success")
-        client_socket.close()
-        self.requests[user_id].append(file_id)
+        with self.requests_condition:
+            return len(self.requests.keys())
+
+    def wait_for_placements(self, nb, timeout=None):
+        '''
+        Waits until nb receivers got their cache, or the timeout expires.
+
+        :return:    (bool) True if the nb receivers got their cache
+        '''
+        with self.requests_condition:
+            return self.requests_condition.wait_for(lambda: len(self.requests) >= nb, timeout)
+
+    def wait_for_ready(self, nb, timeout=None):
+        '''
+        Waits until nb receivers acknowledged they joined the multicast groups, or the timeout expires.
+
+        :return:    (bool) True if the nb receivers are ready
+        '''
+        with self.requests_condition:
+            return self.requests_condition.wait_for(lambda: len(self.ready) >= nb, timeout)
+
+    def register_ready(self, request):
+        '''
+        :param request: (bytes) the READY line of a receiver
+        '''
+        user_id, _ = parse_ready(request)
+        with self.requests_condition:
+            self.ready.add(user_id)
+            self.requests_condition.notify_all()
+
+    def register_nack(self, connection, request):
+        '''
+        Stores the NACK of a receiver until the repair round of its group, the connection stays open to send the unicast repairs.
+        A NACK arriving after its round was collected, or after the end of the session, is answered at once with the end of the round.
+
+        :param connection:  (RepairConnection) the connection of the receiver
+        :param request:     (bytes) the NACK line
+        '''
+        nack = parse_nack(request)
+        with self.nacks_condition:
+            late = self.repairs_closed or nack.repair_round < self.closed_rounds[nack.group]
+            if not late:
+                self.nacks[nack.group, nack.repair_round][nack.receiver] = (nack, connection)
+                self.nacks_condition.notify_all()
+        if late:
+            custom_logger(f"Late NACK of {nack.receiver} for round {nack.repair_round + 1} on {nack.group}, ending the round", level="warning")
+            connection.end_round()
+
+    def wait_for_nacks(self, multicast_group, repair_round, nb, timeout):
+        '''
+        Waits until nb receivers have sent their NACK for the repair round of the group, or the timeout expires.
+        The round is then closed: the NACKs sent for it later are answered at once, see register_nack.
+
+        :return:    (dict) user ID --> (Nack, RepairConnection)
+        '''
+        key = (multicast_group, repair_round)
+        with self.nacks_condition:
+            self.nacks_condition.wait_for(lambda: len(self.nacks[key]) >= nb, timeout)
+            self.closed_rounds[multicast_group] = max(self.closed_rounds[multicast_group], repair_round + 1)
+            return self.nacks.pop(key)
+
+    def close_repairs(self):
+        '''
+        Called at the end of the session: ends the rounds of the NACKs that no repair round collected.
+        '''
+        with self.nacks_condition:
+            self.repairs_closed = True
+            nacks = [connection for round_nacks in self.nacks.values() for _, connection in round_nacks.values()]
+            self.nacks.clear()
+        for connection in nacks:
+            connection.end_round()
+
+    async def handle_client(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=self.send_buffer_size)
+        try:
+            prefix = await reader.readexactly(len(PLACEMENT_MAGIC))
+            if NACK_PREFIX.startswith(prefix):
+                self.register_nack(RepairConnection(self.loop, writer), prefix + await reader.readline())
+                return
+            if READY_PREFIX.startswith(prefix):
+                self.register_ready(prefix + await reader.readline())
+                writer.close()
+                return
+            if prefix != PLACEMENT_MAGIC:
+                raise PlacementProtocolError(f"Unknown request {prefix}")
+            frame_type, length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+            if frame_type != REQUEST:
+                raise PlacementProtocolError(f"Unexpected frame type {frame_type}")
+            request = json.loads((await reader.readexactly(length)).decode('utf-8'))
+            user_id, file_id = int(request["receiver"]), int(request["file"])
+            if self.placement_stats["first_request"] is None:
+                self.placement_stats["first_request"] = time.perf_counter()
+
+            async with self.placement_slots:
+                nb_bytes = await self.send_cache(writer, user_id)
+        except (OSError, ValueError, KeyError, asyncio.IncompleteReadError) as e:
+            custom_logger(f"Placement failed: {e}", level="error")
+            writer.close()
+            return
+        writer.close()
+        self.placement_stats["receivers"] += 1
+        self.placement_stats["bytes"] += nb_bytes
+        self.placement_stats["last_placement"] = time.perf_counter()
+        with self.requests_condition:
+            self.requests[user_id].append(file_id)
+            self.requests_condition.notify_all()
+
+    async def send_cache(self, writer, user_id):
+        '''
+        Sends the multicast addresses and the cache of a receiver (see package.placement_protocol).
+        The subfiles are written from the views of the chunk store, waiting for the send buffer to drain below its limit,
+        so the memory used per connection stays bounded whatever the cache size.
+
+        :return:    (int) the number of bytes sent
+        '''
+        subfiles = [((file_id, ind), value) for file_id, cache in self.users_cache[user_id].items() for ind, value in cache.items()]
+        head = encode_addresses(self.multicast_addresses) + encode_manifest([(file_id, ind, len(value)) for (file_id, ind), value in subfiles])
+        writer.write(head)
+        nb_bytes = len(head)
+        for position, (_, value) in enumerate(subfiles):
+            for buffer in get_subfile_buffers(position, value):
+                writer.write(buffer)
+                nb_bytes += len(buffer)
+            await writer.drain()
+        writer.write(encode_end())
+        await writer.drain()
+        return nb_bytes + len(encode_end())
+
+    def report_placement(self):
+        stats = self.placement_stats
+        if not stats["receivers"]:
+            return
+        duration = stats["last_placement"] - stats["first_request"]
+        throughput = stats["bytes"] * 8 / duration / 1e6 if duration > 0 else 0
+        message = f"Placement: {stats['receivers']} caches, {stats['bytes']} bytes in {duration:.3f} s ({throughput:.2f} Mbps)"
+        self.logger_manager.update("logs", message, append=True)
+        custom_logger(message, level="info")
 
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.placement_slots = asyncio.Semaphore(self.max_clients)
+        server = await asyncio.start_server(self.handle_client, sock=self.server_socket)
+        async with server:
+            await server.serve_forever()
 
     def start(self):
         custom_logger(f"Unicast server listening on {self.host}:{self.port}", level="info")
-        while True:
-            client_socket, _ = self.server_socket.accept()
-            client_handler = threading.Thread(target=self.handle_client, args=(client_socket,))
-            client_handler.start()
\ No newline at end of file
+        asyncio.run(self.serve())
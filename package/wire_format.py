@@ -0,0 +1,261 @@
+'''
+Binary datagram format of the multicast transmissions (version 1).
+
+Every datagram starts with a fixed header (network byte order):
+
+    magic           2s  b"LC"
+    version         B   WIRE_VERSION
+    type            B   DATA, SESSION, END or PARITY
+    session_id      I   identifies the simulation, see get_session_id
+    packet_id       I   number of the coded packet in the transmission
+    fragment_index  H   position of the fragment in the packet
+    fragment_count  H   number of fragments of the packet
+    fragment_offset I   offset of the fragment payload in the packet body
+    body_length     I   total length of the packet body
+
+followed by the raw fragment payload. Once reassembled, the body of a DATA packet is:
+
+    nb_descriptors  B
+    descriptors     nb_descriptors * (file_id H, subfile_id I, length I)
+    payload         the XOR of the described subfiles, zero-padded to the longest one
+
+where subfile_id is the position of the subfile index in the "indices" of the SESSION descriptor.
+The body of a SESSION packet is a UTF-8 JSON object and the body of an END packet is the number of DATA packets (I).
+
+PARITY datagrams carry the forward error correction of a DATA packet (see package.fec). The data fragments are
+protected by blocks of block_size fragments, each block having nb_parity parity fragments. Their header repeats the
+packet_id, fragment_count and body_length of the DATA packet, fragment_index being the parity index in the packet
+(block * nb_parity + parity index in the block), and their payload is:
+
+    block_size      H
+    nb_parity       H
+    parity          the parity fragment, of the length of the data fragments
+
+Before the transmission, each receiver acknowledges over the unicast channel that it joined the multicast groups, with a
+READY line "READY <JSON object>\n" (see encode_ready): the server starts sending once every receiver is ready.
+
+The SESSION packet is sent several times before the DATA packets and once more before the END packet, which is also
+repeated; receivers ignore the duplicates.
+
+After the END packet, each receiver reports what it misses over the unicast channel, with a NACK line
+"REPAIR <JSON object>\n" (see encode_nack): the DATA packets not received at all, the missing fragments of the DATA packets
+received in part, and whether it still needs the SESSION packet. The server answers on the same connection with the datagrams
+it repairs in unicast, each prefixed by its length (REPAIR_FRAME), and a zero length marks the end of the repair round.
+A receiver still missing something after a round sends a new NACK, on a new connection, for up to REPAIR_ROUNDS rounds; the
+server runs a new round while NACKs are not empty. Each NACK carries its round: a NACK for a round the server already closed,
+or sent after the end of the session, is answered at once with the end of the round.
+'''
+import json
+import struct
+import zlib
+from collections import namedtuple
+
+MAGIC = b"LC"
+WIRE_VERSION = 1
+
+DATA = 1
+SESSION = 2
+END = 3
+PARITY = 4
+
+HEADER = struct.Struct("!2sBBIIHHII")
+DESCRIPTOR = struct.Struct("!HII")
+COUNT = struct.Struct("!B")
+END_BODY = struct.Struct("!I")
+FEC_HEADER = struct.Struct("!HH")
+REPAIR_FRAME = struct.Struct("!I")
+NACK_PREFIX = b"REPAIR "
+REPAIR_ROUNDS = 3
+READY_PREFIX = b"READY "
+
+Nack = namedtuple('Nack', ['receiver', 'group', 'repair_round', 'packets', 'fragments', 'session'])
+Header = namedtuple('Header', ['magic', 'version', 'type', 'session_id', 'packet_id',
+                               'fragment_index', 'fragment_count', 'fragment_offset', 'body_length'])
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+def get_session_id(sim_id):
+    return zlib.crc32(str(sim_id).encode('utf-8'))
+
+
+def is_binary_datagram(data):
+    # The version byte is never found in the text of the legacy JSON datagrams, which may start with "LC"
+    return data[:2] == MAGIC and len(data) > 2 and data[2] == WIRE_VERSION
+
+
+def iter_fragments(datagram_type, session_id, packet_id, parts, fragment_size):
+    '''
+    Splits a packet body into datagrams.
+
+    :param datagram_type:   (int) DATA, SESSION or END
+    :param session_id:      (int) the session ID
+    :param packet_id:       (int) the packet number
+    :param parts:           (list) the bytes-like parts of the packet body, in order (they are not concatenated)
+    :param fragment_size:   (int) the maximum payload size of a datagram
+
+    :return:    (generator) for each fragment, the list of buffers of the datagram: the header then payload views
+    '''
+    views = [memoryview(part).cast('B') for part in parts]
+    body_length = sum(len(view) for view in views)
+    fragment_count = max(1, -(-body_length // fragment_size))
+    if fragment_count > 0xFFFF:
+        raise WireFormatError(f"Packet {packet_id} needs {fragment_count} fragments, use a larger fragment size")
+
+    part, position = 0, 0
+    for fragment_index in range(fragment_count):
+        offset = fragment_index * fragment_size
+        remaining = min(fragment_size, body_length - offset)
+        buffers = [HEADER.pack(MAGIC, WIRE_VERSION, datagram_type, session_id, packet_id,
+                               fragment_index, fragment_count, offset, body_length)]
+        while remaining:
+            chunk = views[part][position:position + remaining]
+            if chunk:
+                buffers.append(chunk)
+            remaining -= len(chunk)
+            position += len(chunk)
+            if position == len(views[part]):
+                part, position = part + 1, 0
+        yield buffers
+
+
+def iter_data_fragments(session_id, packet_id, descriptors, payload, fragment_size):
+    '''
+    :param descriptors: (list) tuples (file ID, subfile ID, length) of the XORed subfiles
+    :param payload:     (bytes-like) the coded packet
+    '''
+    head = COUNT.pack(len(descriptors)) + b"".join(DESCRIPTOR.pack(*descriptor) for descriptor in descriptors)
+    return iter_fragments(DATA, session_id, packet_id, [head, payload], fragment_size)
+
+
+def iter_session_fragments(session_id, descriptor, fragment_size):
+    '''
+    :param descriptor:  (dict) the JSON-serializable session descriptor
+    '''
+    return iter_fragments(SESSION, session_id, 0, [json.dumps(descriptor).encode('utf-8')], fragment_size)
+
+
+def iter_end_fragments(session_id, nb_packets, fragment_size):
+    return iter_fragments(END, session_id, nb_packets, [END_BODY.pack(nb_packets)], fragment_size)
+
+
+def iter_parity_fragments(session_id, packet_id, fragment_count, body_length, parities, block_size, nb_parity):
+    '''
+    :param fragment_count:  (int) the number of data fragments of the packet
+    :param body_length:     (int) the body length of the packet
+    :param parities:        (list) all the parity fragments of the packet, block after block
+    '''
+    fec_header = FEC_HEADER.pack(block_size, nb_parity)
+    for index, parity in enumerate(parities):
+        yield [HEADER.pack(MAGIC, WIRE_VERSION, PARITY, session_id, packet_id, index, fragment_count, 0, body_length), fec_header, parity]
+
+
+def get_packet_type(header):
+    '''
+    :return:    (int) the type of the packet the datagram belongs to (PARITY datagrams belong to DATA packets)
+    '''
+    return DATA if header.type == PARITY else header.type
+
+
+def parse_datagram(data):
+    '''
+    Parses the header of a datagram without copying its payload.
+
+    :return:    (tuple) (Header, memoryview of the fragment payload)
+    '''
+    if len(data) < HEADER.size:
+        raise WireFormatError("Datagram shorter than the header")
+    header = Header._make(HEADER.unpack_from(data))
+    if header.magic != MAGIC or header.version != WIRE_VERSION:
+        raise WireFormatError(f"Unsupported datagram (magic {header.magic}, version {header.version})")
+    return header, memoryview(data)[HEADER.size:]
+
+
+def parse_data_body(body):
+    '''
+    :param body:    (bytes-like) a reassembled DATA packet body
+
+    :return:    (tuple) (list of (file ID, subfile ID, length) descriptors, memoryview of the coded payload)
+    '''
+    body = memoryview(body)
+    try:
+        nb_descriptors, = COUNT.unpack_from(body)
+        descriptors = [DESCRIPTOR.unpack_from(body, COUNT.size + i * DESCRIPTOR.size) for i in range(nb_descriptors)]
+    except struct.error as e:
+        raise WireFormatError(f"Truncated DATA body: {e}")
+    return descriptors, body[COUNT.size + nb_descriptors * DESCRIPTOR.size:]
+
+
+def parse_session_body(body):
+    try:
+        descriptor = json.loads(bytes(body).decode('utf-8'))
+    except ValueError as e:
+        raise WireFormatError(f"Invalid SESSION body: {e}")
+    if not isinstance(descriptor, dict):
+        raise WireFormatError("Invalid SESSION body: not an object")
+    return descriptor
+
+
+def parse_end_body(body):
+    try:
+        return END_BODY.unpack_from(body)[0]
+    except struct.error as e:
+        raise WireFormatError(f"Truncated END body: {e}")
+
+
+def parse_parity_payload(payload):
+    '''
+    :return:    (tuple) (block size, number of parity fragments per block, memoryview of the parity fragment)
+    '''
+    try:
+        block_size, nb_parity = FEC_HEADER.unpack_from(payload)
+    except struct.error as e:
+        raise WireFormatError(f"Truncated PARITY payload: {e}")
+    return block_size, nb_parity, payload[FEC_HEADER.size:]
+
+
+def encode_nack(receiver_id, multicast_group, repair_round, packets, fragments=None, session=False):
+    '''
+    :param receiver_id:     (int) the ID of the receiver
+    :param multicast_group: (tuple) the (address, port) of the group
+    :param repair_round:    (int) the repair round, from 0
+    :param packets:         (list) the IDs of the DATA packets not received at all
+    :param fragments:       (dict) packet ID --> indices of the missing fragments, for the DATA packets received in part
+    :param session:         (bool) whether the receiver has no session descriptor
+
+    :return:    (bytes) the NACK line
+    '''
+    nack = {"receiver": receiver_id, "group": list(multicast_group), "round": repair_round, "packets": list(packets),
+            "fragments": {str(packet_id): list(indices) for packet_id, indices in (fragments or {}).items()}, "session": session}
+    return NACK_PREFIX + json.dumps(nack).encode('utf-8') + b"\n"
+
+
+def parse_nack(line):
+    '''
+    :return:    (Nack) the receiver ID, the (address, port) of the group, the repair round, the IDs of the missing packets,
+                packet ID --> indices of its missing fragments, and whether the session descriptor is missing
+    '''
+    nack = json.loads(line[len(NACK_PREFIX):].decode('utf-8'))
+    fragments = {int(packet_id): indices for packet_id, indices in nack.get("fragments", {}).items()}
+    return Nack(nack["receiver"], tuple(nack["group"]), nack.get("round", 0), nack["packets"], fragments, nack.get("session", False))
+
+
+def encode_ready(receiver_id, multicast_groups):
+    '''
+    :param receiver_id:         (int) the ID of the receiver
+    :param multicast_groups:    (list) the (address, port) of the groups the receiver joined
+
+    :return:    (bytes) the READY line
+    '''
+    ready = {"receiver": receiver_id, "groups": [list(group) for group in multicast_groups]}
+    return READY_PREFIX + json.dumps(ready).encode('utf-8') + b"\n"
+
+
+def parse_ready(line):
+    '''
+    :return:    (tuple) (receiver ID, list of the (address, port) of the joined groups)
+    '''
+    ready = json.loads(line[len(READY_PREFIX):].decode('utf-8'))
+    return ready["receiver"], [tuple(group) for group in ready["groups"]]
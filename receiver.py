@@ -1,5 +1,4 @@
 import argparse
-import time
 from package.receiver import MulticastReceiver
 from package.cache import Cache
 
@@ -9,15 +8,12 @@ def main(args):
     FILE_ID = args.request_content
 
     receiver = MulticastReceiver(args.sim_id, USER_ID, args.config, None)
-    cache_file = f'server{USER_ID}-file_{FILE_ID}-test.txt'
+    cache_file = f'server{USER_ID}-file_{FILE_ID}-test.cache'
     cache = Cache(cache_file)
     
-    cache_data = receiver.send_unicast_request(FILE_ID)
-    cache.set_content(cache_data)
+    receiver.send_unicast_request(FILE_ID, cache)
     receiver.set_cache(cache)
-
-    time.sleep(1)  
-    
+    # Joins the multicast groups and sends READY, the server starts the transmission once every receiver did
     receiver.start(FILE_ID)
 
 if __name__ == "__main__":
@@ -1,8 +1,9 @@
 import argparse
 import json
 import threading
-import time
 from package.multicast_server import MulticastServer
+from package.multicast_session import MulticastSession
+from package.placement_artifact import prepare_placement_artifact
 from package.unicast_server import UnicastServer
 from common.utils import custom_logger, read_config
 
@@ -11,6 +12,17 @@ def main(args):
         config = read_config(args.config)
         multicast_groups = config['MULTICAST_GROUPS']
         library_file = config['LIBRARY_FILE']
+        encoding_workers = config['ENCODING_WORKERS']
+        wire_format = config['WIRE_FORMAT']
+        fec_ratio = config['FEC_RATIO']
+        fec_block_size = config['FEC_BLOCK_SIZE']
+        send_rate_mbps = config['SEND_RATE_MBPS']
+        send_rate_pps = config['SEND_RATE_PPS']
+        mtu = config['MTU']
+        socket_sndbuf = config['SOCKET_SNDBUF']
+        user_group_size = config['USER_GROUP_SIZE']
+        group_mode = config['GROUP_MODE']
+        placement_file = config['PLACEMENT_FILE']
         with open(library_file, 'r') as file:
             library = json.load(file)
             files = library['files']
@@ -21,21 +33,24 @@ def main(args):
     receivers = ['paul', 'anto', 'jony', 'elio', 'rony']
     requested_files = dict({1: 2, 2: 5, 3: 6, 4: 8, 5: 9})
     cache_capacity = 4
-    
-    
 
-    for i in range(len(multicast_groups)):
-        group = multicast_groups[i]
-        # custom_logger(f"Starting mutlicast on {str(group)}", level="info")
-        if i == 0:
-            multicast_server = MulticastServer(args.sim_id, group, files, receivers, cache_capacity, requested_files, args.nb_receivers)
-            unicast_server = UnicastServer(args.sim_id, users_cache=multicast_server.get_users_cache(), config_file=args.config)
-            threading.Thread(target=unicast_server.start).start()
-            multicast_server.start(unicast_server)
-        else:
-            multicast_server = MulticastServer(args.sim_id, group, files, receivers, cache_capacity, requested_files, args.nb_receivers)
-            multicast_server.start(unicast_server=None)
-        time.sleep(5)
+    if args.prepare:
+        # Offline step: writes the placement artifact and exits, the next servers start from it
+        if not placement_file:
+            custom_logger("No placement_file configured", level="error")
+            return
+        session = MulticastSession(library=files, receivers=receivers, cache_capacity=cache_capacity, group_size=user_group_size)
+        prepare_placement_artifact(placement_file, session)
+        return
+
+
+    # One server for all the groups: the session, the chunks and the coded packets are built once and sent on every group at the same time
+    multicast_server = MulticastServer(args.sim_id, multicast_groups, files, receivers, cache_capacity, requested_files, args.nb_receivers, encoding_workers, wire_format=wire_format, fec_ratio=fec_ratio, fec_block_size=fec_block_size,
+                                       rate_mbps=send_rate_mbps, rate_pps=send_rate_pps, mtu=mtu, sndbuf=socket_sndbuf, group_size=user_group_size, group_mode=group_mode,
+                                       placement_file=placement_file)
+    unicast_server = UnicastServer(args.sim_id, users_cache=multicast_server.get_users_cache(), config_file=args.config)
+    threading.Thread(target=unicast_server.start).start()
+    multicast_server.start(unicast_server)
 
 
 
@@ -47,5 +62,6 @@ if __name__ == "__main__":
     parser.add_argument('nb_receivers', help='The number of expected receivers.',  type=int)  # positional argument
     parser.add_argument('-c', '--config', help='The config file associated with the server.', required=True, type=str)  # required option that takes a value
     parser.add_argument('-sim_id', '--sim_id', help='The simulation_id.', required=True, type=str)  # required option that takes a value
+    parser.add_argument('--prepare', help='Prepares the placement artifact of the session and exits.', action='store_true')
 
     main(parser.parse_args())